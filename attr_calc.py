@@ -1,10 +1,81 @@
 import math
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
 
-def doll_attr_calculate(doll, my_doll, equip_group):
+import numpy as np
+
+from gf_utils import GameData
+
+EQUIP_ATTR_KEYS = ["hp", "pow", "rate", "hit", "dodge", "armor"]
+EQUIP_FIXED_KEYS = ["critical_harm_rate", "critical_percent", "armor_piercing", "night_view_percent", "bullet_number_up"]
+EQUIP_VECTOR_KEYS = EQUIP_ATTR_KEYS + EQUIP_FIXED_KEYS + ["skill_effect", "skill_effect_per"]
+
+
+def doll_base_attr(doll, my_doll):
+    # hp/pow/rate/hit/dodge/armor before equipment, depends on level and favor only
     lv = my_doll['gun_level']
     favor_factor = 0.95 + (my_doll['favor']+10)//50*0.05
 
-    attr_change = {"hp": 0, "pow": 0, "rate": 0, "hit": 0, "dodge": 0, "armor": 0}
+    base = {"hp": 0, "pow": 0, "rate": 0, "hit": 0, "dodge": 0, "armor": 0}
+    for key in ["pow", "hit", "dodge"]:
+        base[key] = gf_ceil(calculate(lv, key, doll) * favor_factor)
+    for key in ["hp", "rate", "armor"]:
+        base[key] = gf_ceil(calculate(lv, key, doll))
+    return base
+
+
+class BaseAttrCache:
+    """Bounded LRU cache of doll_base_attr keyed by (gun_id, level, favor).
+
+    Entries are only valid for the gun table they were computed from, so the
+    cache belongs to one GameData (see get_base_attr_cache) and is dropped with
+    it on GameData.reload(). Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doll, my_doll):
+        key = (doll["id"], my_doll["gun_level"], my_doll["favor"])
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+        base = MappingProxyType(doll_base_attr(doll, my_doll))
+        with self._lock:
+            self.misses += 1
+            self._data[key] = base
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return base
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_base_attr_cache(game_data):
+    if isinstance(game_data, GameData):
+        return game_data.compiled("base_attr", lambda data: BaseAttrCache())
+    return BaseAttrCache()
+
+
+def doll_attr_calculate(doll, my_doll, equip_group, base_cache=None):
+    lv = my_doll['gun_level']
+
+    base = base_cache.get(doll, my_doll) if base_cache is not None else doll_base_attr(doll, my_doll)
+    attr_change = dict(base)
     attr_fixed = {"critical_harm_rate": 150, "critical_percent": doll['crit'],
                   "armor_piercing": doll['armor_piercing'], "night_view_percent": 0, "bullet_number_up": doll['special']}
     attr_other = {
@@ -12,10 +83,6 @@ def doll_attr_calculate(doll, my_doll, equip_group):
         "skill_effect_per": 0, "skill_effect": 0, 
         'number': my_doll['number'], 'skill1':my_doll['skill1'], 'skill2':my_doll['skill2']}
 
-    for key in ["pow", "hit", "dodge"]:
-        attr_change[key] = gf_ceil(calculate(lv, key, doll) * favor_factor)
-    for key in ["hp", "rate", "armor"]:
-        attr_change[key] = gf_ceil(calculate(lv, key, doll))
     for equip, elv in equip_group:
         if not equip:
             continue
@@ -93,6 +160,89 @@ def doll_effect_calculate(gun_attr, fight_type):
     return effect_total
 
 
+def equip_vector(equip, elv):
+    # stat bonus of one equipment in EQUIP_VECTOR_KEYS order, summable over a loadout
+    vector = []
+    for attr in EQUIP_ATTR_KEYS + EQUIP_FIXED_KEYS:
+        value = 0
+        if attr in equip['stat'].keys():
+            stat = equip['stat'][attr]
+            modif = 1
+            if 'upgrade' in stat.keys() and elv == 10:
+                modif += stat['upgrade']/1000
+            value = math.floor(stat['max'] * modif)
+        vector.append(value)
+    vector += [equip["skill_effect"], equip["skill_effect_per"]]
+    return vector
+
+
+def doll_attr_calculate_batch(doll, my_doll, equip_vectors, base_cache=None):
+    """doll_attr_calculate for many loadouts of one doll in a single numpy pass.
+
+    equip_vectors holds one row per loadout, the sum of equip_vector over its
+    equipments. Returns {"day": array, "night": array}, element-wise identical
+    to doll_attr_calculate.
+    """
+    bonus = np.asarray(equip_vectors, dtype=np.int64).reshape(-1, len(EQUIP_VECTOR_KEYS))
+    lv = my_doll['gun_level']
+
+    attr = {"critical_harm_rate": 150, "critical_percent": doll['crit'],
+            "armor_piercing": doll['armor_piercing'], "night_view_percent": 0, "bullet_number_up": doll['special'],
+            "skill_effect_per": 0, "skill_effect": 0}
+    attr.update(base_cache.get(doll, my_doll) if base_cache is not None else doll_base_attr(doll, my_doll))
+    for i, key in enumerate(EQUIP_VECTOR_KEYS):
+        attr[key] = attr[key] + bonus[:, i]
+    attr_other = {
+        "star": doll["rank"], "upgrade": lv, "type": doll["type"],
+        'number': my_doll['number'], 'skill1':my_doll['skill1'], 'skill2':my_doll['skill2']}
+
+    day = doll_effect_calculate_batch(attr, attr_other, "day")
+    night = doll_effect_calculate_batch(attr, attr_other, "night")
+
+    return {"day": day, "night": night}
+
+
+def doll_effect_calculate_batch(attr, attr_other, fight_type):
+    # same formulas and operation order as doll_effect_calculate, so float results match bit for bit
+    skill1 = attr_other['skill1']
+    skill2 = attr_other['skill2']
+    star = int(attr_other["star"])
+    number = attr_other["number"]
+    skill_effect = attr["skill_effect"]
+    skill_effect_per = attr["skill_effect_per"]
+
+    doll_skill_effect = gf_ceil_array(number*(0.8+star/10)*(35+5*(skill1-1))*(100+skill_effect_per)/100) + skill_effect
+    if attr_other["upgrade"] >= 110:
+        doll_skill_effect = doll_skill_effect + gf_ceil_array(number*(0.8+star/10)*(15+2*(skill2-1))*(100+skill_effect_per)/100)
+
+    life = attr["hp"]
+    dodge = attr["dodge"]
+    armor = attr["armor"]
+    defend_effect = gf_ceil_array(life*number*(35+dodge)/35*(4.2*100/np.maximum(1, 100-armor)-3.2))
+
+    hit = attr["hit"]
+    night_view_percent = attr["night_view_percent"]
+    if fight_type == "night":
+        hit = gf_ceil_array(hit*(1+(-0.9*(1-night_view_percent/100))))
+
+    attack = attr["pow"]
+    rate = attr["rate"]
+    critical = attr["critical_percent"]
+    critical_damage = attr["critical_harm_rate"]
+    armor_piercing = attr["armor_piercing"]
+    bullet = attr["bullet_number_up"]
+    if attr_other["type"] == 6:
+        attack_effect = gf_ceil_array(6*number*(3*bullet*(attack+armor_piercing/3)*(1+critical*(critical_damage-100)/10000)/(1.5+bullet*50/rate+0.5*bullet)*hit/(hit+23)+8))
+    elif attr_other["type"] == 5:
+        attack_effect = gf_ceil_array(7*number*(bullet*(attack+armor_piercing/3)*(1+critical*(critical_damage-100)/10000)/(bullet/3+4+200/rate)*hit/(hit+23)+8))
+    elif attr_other["type"] in [1,2,3,4]:
+        attack_effect = gf_ceil_array(5*number*((attack+armor_piercing/3)*(1+critical*(critical_damage-100)/10000)*rate/50*hit/(hit+23)+8))
+    else:
+        exit('gun type error: '+str(attr_other["type"]))
+    effect_total = doll_skill_effect + defend_effect + attack_effect
+    return effect_total
+
+
 def stc_to_text(text, name):
     tem = text[text.find(name) + len(name) + 1:]
     out_text = tem[:tem.find("\n")]
@@ -116,6 +266,13 @@ def gf_ceil(number):
         number = number - (number % 1) + 1
     return int(number)
 
+
+def gf_ceil_array(number):
+    # element-wise gf_ceil, np.mod follows the sign rules of python's %
+    number = np.asarray(number, dtype=np.float64)
+    frac = np.mod(number, 1)
+    return np.where(frac < 0.0001, number - frac, number - frac + 1).astype(np.int64)
+
 BASIC = [16, 45, 5, 5]
 BASIC_LIFE_ARMOR = [
     [[55, 0.555], [2, 0.161]],
@@ -213,4 +370,6 @@ if __name__=='__main__':
         10)
     ]
     eff = doll_attr_calculate(gun,my_gun,equips)
-    print(eff)
\ No newline at end of file
+    print(eff)
+    vectors = [sum(v) for v in zip(*[equip_vector(e, elv) for e, elv in equips])]
+    print(doll_attr_calculate_batch(gun,my_gun,[vectors]))
\ No newline at end of file
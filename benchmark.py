@@ -0,0 +1,497 @@
+# %%
+"""Micro-benchmarks for the solver pipeline, run against downloaded game data.
+
+python benchmark.py attr -r ch
+python benchmark.py solve -r ch --theater 848 --solvers cbc highs
+python benchmark.py tables -r ch
+python benchmark.py store -r ch
+python benchmark.py user_info -r ch -n 200000
+python benchmark.py json -r ch -n 200000
+python benchmark.py startup --theater 848
+python benchmark.py server -r ch --theater 848
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import timeit
+import tracemalloc
+from pathlib import Path
+
+from attr_calc import (
+    BaseAttrCache,
+    doll_attr_calculate,
+    doll_attr_calculate_batch,
+    equip_vector,
+)
+from download_data import TABLES
+from downloader import read_stored, store_bytes
+from equip_table import parse_equip_stat
+from game_columns import GAME_DATA_COLUMNS
+from gf_utils import GameData, table_files
+from json_reader import JSON_BACKENDS, read_json
+from load_user_info import load_perfect_info, load_user_info
+from lp_model import SOLVER_BACKENDS, LpModel, get_backend
+from prepare_choices import prepare_choices
+from recipe_table import recipe_capacity
+
+
+def sample_loadouts(game_data, dolls, per_doll, seed=0):
+    # [(doll, my_doll, [[(equip, elv)] * 3] * per_doll)] from the perfect roster
+    rng = random.Random(seed)
+    user_gun, _ = load_perfect_info(game_data)
+    equips = [
+        dict(equip, stat=parse_equip_stat(equip))
+        for equip in game_data["equip"].values()
+        if equip["rank"] == 5
+    ]
+    samples = []
+    for my_doll in rng.sample(list(user_gun.values()), min(dolls, len(user_gun))):
+        groups = [
+            [(rng.choice(equips), rng.choice([0, 10])) for _ in range(3)]
+            for _ in range(per_doll)
+        ]
+        samples.append((game_data["gun"][my_doll["gun_id"]], my_doll, groups))
+    return samples
+
+
+def bench_attr(game_data, count, repeat):
+    samples = sample_loadouts(game_data, 50, count // 50)
+    count = sum(len(groups) for _, _, groups in samples)
+    cache = BaseAttrCache()
+    vectors = [
+        [
+            [sum(v) for v in zip(*[equip_vector(e, elv) for e, elv in group])]
+            for group in groups
+        ]
+        for _, _, groups in samples
+    ]
+
+    def scalar():
+        for doll, my_doll, groups in samples:
+            for group in groups:
+                doll_attr_calculate(doll, my_doll, group)
+
+    def scalar_cached():
+        for doll, my_doll, groups in samples:
+            for group in groups:
+                doll_attr_calculate(doll, my_doll, group, base_cache=cache)
+
+    def batch_cached():
+        for (doll, my_doll, _), doll_vectors in zip(samples, vectors):
+            doll_attr_calculate_batch(doll, my_doll, doll_vectors, base_cache=cache)
+
+    for name, func in [
+        ("doll_attr_calculate", scalar),
+        ("doll_attr_calculate, cached base", scalar_cached),
+        ("doll_attr_calculate_batch, per doll", batch_cached),
+    ]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:<36}{best / count * 1e6:8.2f} us/combination")
+    print(f"base attr cache: {cache.hits} hits, {cache.misses} misses")
+
+
+def bench_solve(game_data, theater_id, max_dolls, solvers, repeat):
+    # same model for every backend: perfect roster, fairy ratio 2
+    user_gun, user_equip = load_perfect_info(game_data)
+    upgrade_resource = 3 * max_dolls * 3
+    choices = prepare_choices(
+        user_gun,
+        user_equip,
+        theater_id,
+        max_dolls,
+        2,
+        game_data,
+        upgrade_resource=upgrade_resource,
+    )
+    capacity = recipe_capacity(user_gun, user_equip, max_dolls, upgrade_resource)
+    model = LpModel.from_recipes(choices, capacity, {"score": 1, "upgrade": 0.001})
+    print(f"{len(choices)} recipes, {len(model.rows)} resources")
+    for name in solvers:
+        try:
+            backend = get_backend(name)
+        except ImportError as e:
+            print(f"{name:<8}skipped: {e}")
+            continue
+        runs = []
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            solution = backend.solve(model)
+            runs.append((timeit.default_timer() - start, solution))
+        total = statistics.median(t for t, _ in runs)
+        write = statistics.median(s.timings["write"] for _, s in runs)
+        print(
+            f"{name:<8}{total * 1000:9.1f} ms/solve "
+            f"({write * 1000:.1f} ms model hand-off), "
+            f"objective {runs[-1][1].objective:.3f}"
+        )
+
+
+def bench_tables(data_dir, repeat, tables=("gun", "equip")):
+    # load time and retained memory of whole rows against projected columns
+    def load(**kwargs):
+        game_data = GameData(data_dir, **kwargs)
+        return [game_data[name] for name in tables]
+
+    for label, columns in [("dicts", None), ("projected", GAME_DATA_COLUMNS)]:
+        tracemalloc.start()
+        loaded = load(columns=columns, snapshot=False)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del loaded
+        load(columns=columns)  # make sure the snapshot exists
+        json_time, snapshot_time = (
+            min(
+                timeit.repeat(
+                    lambda: load(columns=columns, snapshot=snapshot),
+                    number=1,
+                    repeat=repeat,
+                )
+            )
+            for snapshot in [False, True]
+        )
+        print(
+            f"{label:<10}{size / 2**20:8.2f} MiB retained, "
+            f"{json_time * 1000:7.1f} ms from json, "
+            f"{snapshot_time * 1000:7.1f} ms from snapshot"
+        )
+
+
+def bench_store(data_dir, repeat):
+    # disk size, the page cache a cold load fills, against parse time of every
+    # table, stored plain and gzip-compressed
+    tables = {
+        name: read_stored(path)
+        for name, path in table_files(data_dir).items()
+        if name in TABLES
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, suffix in [("plain", ".json"), ("gzip", ".json.gz")]:
+            store = Path(tmp) / label
+            store.mkdir()
+            for name, body in tables.items():
+                path = store / f"{name}{suffix}"
+                path.write_bytes(store_bytes(path, body))
+            size = sum(p.stat().st_size for p in store.iterdir())
+            load_time = min(
+                timeit.repeat(
+                    lambda: [GameData(store, snapshot=False)[name] for name in tables],
+                    number=1,
+                    repeat=repeat,
+                )
+            )
+            print(
+                f"{label:<7}{size / 2**20:8.2f} MiB on disk, "
+                f"{load_time * 1000:7.1f} ms to parse {len(tables)} tables"
+            )
+
+
+def load_user_info_pandas(user_info, game_data):
+    # the former DataFrame implementation of load_user_info, for reference
+    import pandas as pd
+
+    gun_info, equip_info = game_data["gun"], game_data["equip"]
+    gun_user_df = pd.DataFrame.from_records(user_info["gun_with_user_info"])
+    gun_user_df = gun_user_df.reindex(
+        columns=["gun_id", "gun_level", "skill1", "skill2", "number", "favor"]
+    )
+    for c in gun_user_df.columns:
+        gun_user_df[c] = pd.to_numeric(gun_user_df[c])
+    gun_user_df["raw_gun_id"] = gun_user_df["gun_id"] % 20000
+    gun_user_df["favor"] = gun_user_df["favor"] // 10000
+    gun_user_df_agg = gun_user_df.groupby("raw_gun_id").agg("max")
+    gun_user_df_agg["name"] = gun_user_df_agg["gun_id"].map(
+        lambda idx: gun_info[idx]["name"]
+    )
+    gun_user_record = gun_user_df_agg.to_dict(orient="index")
+
+    equip_user_df = pd.DataFrame.from_dict(
+        user_info["equip_with_user_info"], orient="index"
+    ).reindex(columns=["equip_id", "equip_level"])
+    for c in equip_user_df.columns:
+        equip_user_df[c] = pd.to_numeric(equip_user_df[c])
+    equip_user_df["equip_level"] = equip_user_df["equip_level"].map(
+        lambda x: 0 if x < 10 else 10
+    )
+    equip_user_df["level_10"] = equip_user_df["equip_level"].map(
+        lambda x: 1 if x == 10 else 0
+    )
+    equip_user_df["level_00"] = equip_user_df["equip_level"].map(
+        lambda x: 0 if x == 10 else 1
+    )
+    equip_user_df_agg = (
+        equip_user_df.groupby(["equip_id"])
+        .agg("sum")
+        .reset_index()
+        .drop(columns=["equip_level"])
+    )
+    equip = equip_user_df_agg["equip_id"].map(lambda idx: equip_info[idx])
+    equip_user_df_agg["name"] = equip.map(lambda e: e["name"])
+    equip_user_df_agg["rank"] = equip.map(lambda e: e["rank"])
+    equip_user_df_agg["upgrade"] = equip.map(
+        lambda e: -1 if not e["bonus_type"] else int(e["exclusive_rate"])
+    )
+    equip_user_df_agg["fit_guns"] = equip.map(
+        lambda e: [int(i) for i in e["fit_guns"].split(",")] if e["fit_guns"] else []
+    )
+    equip_user_df_agg = equip_user_df_agg.query("rank==5").set_index(
+        "equip_id", drop=False
+    )
+    return gun_user_record, equip_user_df_agg.to_dict(orient="index")
+
+
+def sample_user_info(game_data, user_info, count, seed=0):
+    # an export of about count records, copies of the real ones at other levels
+    rng = random.Random(seed)
+    guns, equips = user_info["gun_with_user_info"], user_info["equip_with_user_info"]
+    gun_ids = [idx for idx in game_data["gun"] if idx < 9000 or 20000 < idx < 30000]
+    equip_ids = list(game_data["equip"])
+    sample = {"gun_with_user_info": [], "equip_with_user_info": {}}
+    for i in range(count // 2):
+        gun = dict(rng.choice(guns), id=str(i), gun_id=str(rng.choice(gun_ids)))
+        gun["gun_level"] = str(rng.randint(1, 120))
+        sample["gun_with_user_info"].append(gun)
+        equip = dict(rng.choice(list(equips.values())), id=str(i))
+        equip["equip_id"] = str(rng.choice(equip_ids))
+        equip["equip_level"] = str(rng.choice([0, 5, 10]))
+        sample["equip_with_user_info"][str(i)] = equip
+    return sample
+
+
+def bench_user_info(game_data, user_info_path, count, repeat) -> bool:
+    # time of both loaders on a large export, True if their records differ
+    user_info = json.loads(Path(user_info_path).read_text("utf-8"))
+    differ = False
+    for label, info in [
+        ("export", user_info),
+        ("sample", sample_user_info(game_data, user_info, count)),
+    ]:
+        new = load_user_info(info, game_data)
+        old = load_user_info_pandas(info, game_data)
+        same = all(a == b and list(a) == list(b) for a, b in zip(new, old))
+        differ |= not same
+        records = len(info["gun_with_user_info"]) + len(info["equip_with_user_info"])
+        times = [
+            min(timeit.repeat(lambda: load(info, game_data), number=1, repeat=repeat))
+            for load in [load_user_info_pandas, load_user_info]
+        ]
+        print(
+            f"{label:<8}{records:8d} records, pandas {times[0] * 1000:8.1f} ms, "
+            f"streaming {times[1] * 1000:7.1f} ms, "
+            f"{'same records' if same else 'RECORDS DIFFER'}"
+        )
+    return differ
+
+
+def bench_json(game_data, user_info_path, count, repeat):
+    # one read and the fastest parser against decoding once per encoding tried
+    user_info = json.loads(Path(user_info_path).read_text("utf-8"))
+    sample = sample_user_info(game_data, user_info, count)
+    for gun in sample["gun_with_user_info"]:
+        gun["name"] = f"人形{gun['gun_id']}"
+    text = json.dumps(sample, ensure_ascii=False)
+
+    def per_encoding(path, encodings):
+        for encoding in encodings:
+            try:
+                return json.loads(Path(path).read_text(encoding=encoding))
+            except UnicodeDecodeError:
+                pass
+
+    backends = [name for name in JSON_BACKENDS if importlib.util.find_spec(name)]
+    backends = [name for name in backends if name != "json"] + ["json"]
+    with tempfile.TemporaryDirectory() as tmp:
+        for encoding, tried in [("ascii", "gbk"), ("utf-8", "gbk"), ("gbk", "utf-8")]:
+            path = Path(tmp) / f"{encoding}.json"
+            if encoding == "ascii":
+                path.write_text(json.dumps(sample), "ascii")
+            else:
+                path.write_text(text, encoding)
+            # the former loop, worst case: the wrong encoding tried first
+            times = [
+                min(
+                    timeit.repeat(
+                        lambda: per_encoding(path, [tried, encoding]),
+                        number=1,
+                        repeat=repeat,
+                    )
+                )
+            ] + [
+                min(
+                    timeit.repeat(
+                        lambda: read_json(path, ["gbk"], backend),
+                        number=1,
+                        repeat=repeat,
+                    )
+                )
+                for backend in backends
+            ]
+            print(
+                f"{encoding:<6}{path.stat().st_size / 2**20:6.1f} MiB, "
+                f"per encoding {times[0] * 1000:7.1f} ms, "
+                + ", ".join(
+                    f"{name} {t * 1000:7.1f} ms" for name, t in zip(backends, times[1:])
+                )
+            )
+
+
+def bench_startup(theater_id, max_dolls, repeat):
+    # new processes of main_cli over a bare interpreter, for information only:
+    # tests/test_startup.py checks what start-up imports
+    def run(*args):
+        command = [sys.executable, *args]
+        return min(
+            timeit.repeat(
+                lambda: subprocess.run(command, capture_output=True, check=True),
+                number=1,
+                repeat=repeat,
+            )
+        )
+
+    bare = run("-c", "pass")
+    cli = ["main_cli.py", str(theater_id), "-m", str(max_dolls)]
+    if not Path("info/user_info.json").exists():
+        cli.append("-p")
+    subprocess.run([sys.executable, *cli], capture_output=True, check=True)
+    for label, args in [("--help", ["main_cli.py", "--help"]), ("cached", cli)]:
+        extra = run(*args) - bare
+        print(
+            f"{label:<8}{extra * 1000:7.1f} ms over python -c pass "
+            f"({bare * 1000:.1f} ms)"
+        )
+
+
+def check_server(region, theater_id, max_dolls, user_info_path) -> bool:
+    # real requests to solve_server on a free port, True if any answer is wrong
+    from solve_server import MAX_BODY, SolveServer, SolveService
+
+    service = SolveService(workers=1, queue_size=1)
+    server = SolveServer(("127.0.0.1", 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def request(method, path, body=b"", length=None):
+        conn = http.client.HTTPConnection(*server.server_address, timeout=600)
+        conn.putrequest(method, path)
+        conn.putheader("Content-Length", str(len(body) if length is None else length))
+        conn.endheaders(body)
+        response = conn.getresponse()
+        value = json.loads(response.read())
+        conn.close()
+        return response.status, value
+
+    user_info = json.loads(Path(user_info_path).read_text("utf-8"))
+    solve = json.dumps(
+        dict(
+            region=region,
+            theater_id=theater_id,
+            max_dolls=max_dolls,
+            user_info=user_info,
+        )
+    ).encode("utf-8")
+    failed = False
+    try:
+        for label, (method, path, body, length), ok in [
+            (
+                "solve",
+                ("POST", "/solve", solve, None),
+                lambda status, value: status == 200
+                and 0 < len(value["g_records"]) <= max_dolls
+                and value["score"] == sum(r["score"] for r in value["g_records"]),
+            ),
+            (
+                "status",
+                ("GET", "/status", b"", None),
+                lambda status, value: status == 200 and region in value["regions"],
+            ),
+            (
+                "not a stage",
+                (
+                    "POST",
+                    "/solve",
+                    solve.replace(b'"theater_id": ', b'"theater_id": -'),
+                    None,
+                ),
+                lambda status, value: status == 400,
+            ),
+            (
+                "bad json",
+                ("POST", "/solve", b"{", None),
+                lambda status, value: status == 400,
+            ),
+            (
+                "negative length",
+                ("POST", "/solve", b"", -1),
+                lambda status, value: status == 400,
+            ),
+            (
+                "too large",
+                ("POST", "/solve", b"", MAX_BODY + 1),
+                lambda status, value: status == 413,
+            ),
+        ]:
+            status, value = request(method, path, body, length)
+            failed |= not ok(status, value)
+            print(f"{label:<16}{status} {'ok' if ok(status, value) else 'WRONG'}")
+    finally:
+        server.shutdown()
+        service.close()
+    return failed
+
+
+if __name__ == "__main__":
+    os.chdir(Path(__file__).resolve().parent)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "bench",
+        choices=[
+            "attr",
+            "solve",
+            "tables",
+            "store",
+            "user_info",
+            "json",
+            "startup",
+            "server",
+        ],
+    )
+    parser.add_argument("-r", "--region", type=str, default="ch")
+    parser.add_argument("-n", "--count", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--theater", type=int, default=848)
+    parser.add_argument("-m", "--max_dolls", type=int, default=30)
+    parser.add_argument(
+        "--solvers", nargs="+", choices=list(SOLVER_BACKENDS), default=["cbc"]
+    )
+    args = parser.parse_args()
+
+    game_data = GameData(f"data/{args.region}")
+    if args.bench == "attr":
+        bench_attr(game_data, args.count, args.repeat)
+    elif args.bench == "solve":
+        bench_solve(game_data, args.theater, args.max_dolls, args.solvers, args.repeat)
+    elif args.bench == "tables":
+        bench_tables(f"data/{args.region}", args.repeat)
+    elif args.bench == "store":
+        bench_store(f"data/{args.region}", args.repeat)
+    elif args.bench == "user_info":
+        sys.exit(
+            bench_user_info(game_data, "info/user_info.json", args.count, args.repeat)
+        )
+    elif args.bench == "json":
+        bench_json(game_data, "info/user_info.json", args.count, args.repeat)
+    elif args.bench == "startup":
+        bench_startup(args.theater, args.max_dolls, args.repeat)
+    elif args.bench == "server":
+        sys.exit(
+            check_server(
+                args.region, args.theater, args.max_dolls, "info/user_info.json"
+            )
+        )
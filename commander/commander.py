@@ -34,7 +34,13 @@ class Commander:
         else:
             user_gun, user_equip = load_user_info(self.user_data, game_data)
         choices = prepare_choices(
-            user_gun, user_equip, theater_id, max_dolls, fairy_ratio, game_data
+            user_gun,
+            user_equip,
+            theater_id,
+            max_dolls,
+            fairy_ratio,
+            game_data,
+            upgrade_resource=upgrade_resource,
         )
 
         resource = {}
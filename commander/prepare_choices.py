@@ -1,9 +1,14 @@
 import itertools
+import logging
 import math
 from functools import reduce
 
+from dominance import dominance_keys, prune_dominated
+
 from .attr_calc import doll_attr_calculate
 
+logger = logging.getLogger(__name__)
+
 
 def get_theater_config(theater_id, theater_area):
     area_cfg = theater_area[theater_id]
@@ -16,12 +21,36 @@ def get_theater_config(theater_id, theater_area):
     return dict(class_weight=class_weight, advantage=advantage, fight_mode=fight_mode)
 
 
+def equip_stat_vector(equip, elv, keys):
+    vector = [equip["skill_effect"], equip["skill_effect_per"]]
+    for k in keys:
+        stat = equip["stat"].get(k)
+        if stat is None:
+            vector.append(0)
+            continue
+        modif = 1
+        if "upgrade" in stat.keys() and elv == 10:
+            modif += stat["upgrade"] / 1000
+        vector.append(math.floor(stat["max"] * modif))
+    return vector
+
+
 def prepare_choices(
-    user_gun, user_equip, theater_id, max_dolls, fairy_ratio, game_data
+    user_gun,
+    user_equip,
+    theater_id,
+    max_dolls,
+    fairy_ratio,
+    game_data,
+    upgrade_resource=None,
+    prune=True,
+    stats=None,
 ) -> dict[str, dict[str, dict[str, int]]]:
     gun_info, equip_info = game_data["gun"], game_data["equip"]
     theater_config = get_theater_config(theater_id, game_data["theater_area"])
     choices = {}
+    stats = {} if stats is None else stats
+    stats.update(candidates=0, pruned=0)
 
     for eid, equip in equip_info.items():
         stat = {}
@@ -69,6 +98,13 @@ def prepare_choices(
             }
             recipe_info = {"eid": eid}
             choices[recipe_name] = {"content": recipe_content, "info": recipe_info}
+    # with enough upgrade resource for every equipped slot, upgradable copies
+    # count as +10 copies when checking shortages
+    max_rate = max([v["upgrade"] for v in user_equip.values()], default=0)
+    upgrade_slack = (
+        upgrade_resource is not None and upgrade_resource >= 3 * max_dolls * max_rate
+    )
+    pruned_slots = {}
     # pprint(equip_type_groups)
     for id, my_gun in user_gun.items():
         gun = gun_info[my_gun["gun_id"]]
@@ -98,6 +134,26 @@ def prepare_choices(
             + [(k, 0) for k, v in t.items() if v["level_00"] > 0]
             for t in equip_types
         ]
+        stats["candidates"] += sum(len(c) for c in equip_choices)
+        if prune:
+            keys = dominance_keys(gun, theater_config["fight_mode"])
+            for i, options in enumerate(equip_choices):
+                cache_key = (tuple(options), tuple(keys))
+                if cache_key not in pruned_slots:
+                    kept = prune_dominated(
+                        options,
+                        [
+                            equip_stat_vector(equip_info[eid], elv, keys)
+                            for eid, elv in options
+                        ],
+                        [equip_info[eid]["type"] for eid, _ in options],
+                        user_equip,
+                        max_dolls,
+                        upgrade_slack,
+                    )
+                    pruned_slots[cache_key] = [options[k] for k in kept]
+                equip_choices[i] = pruned_slots[cache_key]
+                stats["pruned"] += len(options) - len(equip_choices[i])
         for equips in itertools.product(*equip_choices):
             if len({equip_info[eid]["type"] for eid, elv in equips}) < 3:
                 continue
@@ -136,6 +192,9 @@ def prepare_choices(
                 "score": score,
             }
             choices[recipe_name] = {"content": recipe_content, "info": recipe_info}
+    logger.info(
+        f"Pruned {stats['pruned']} of {stats['candidates']} equipment candidates"
+    )
     return choices
 
 
@@ -1,14 +1,29 @@
 import itertools
+import logging
 import math
-from dataclasses import dataclass
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
 from typing import *
 
+import numpy as np
 import pulp as lp
 from gf_utils2.gamedata import GameData
 from gf_utils2.userinfo.base import BaseGameObject
 from gf_utils2.userinfo.gun import Equip, Gun
 from gf_utils2.userinfo.user_info import UserInfo
+from dominance import dominance_keys, prune_dominated
+from lp_model import LpModel, LpSolution, SolverBackend, get_backend
+from result_cache import ResultCache, content_hash
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(data_dir: Path) -> None:
+    # each worker opens the game data itself instead of unpickling a copy
+    BaseGameObject.set_gamedata(GameData(data_dir / "stc", data_dir / "table"))
 
 
 @dataclass
@@ -35,14 +50,71 @@ class RecipeRecord:
     info: Equip | GunChoiceInfo
 
 
+@dataclass
+class SolveState:
+    """The last solve of a Commander, kept to re-solve when only parameters change.
+
+    choices were generated for max_dolls and upgrade_slack; they stay valid for
+    fewer dolls and as long as upgrade_slack is not lost, see reusable.
+    class_weight, sp_ratio and effect give the score of every recipe for
+    another fairy_ratio, and x is the last optimum used as a MIP start.
+    """
+
+    user_data: dict
+    use_perfect: bool
+    theater_id: int
+    max_dolls: int
+    upgrade_slack: bool
+    fairy_ratio: float
+    user_gun: dict[int, Gun]
+    user_equip: dict[int, EquipUserRecord]
+    choices: dict[str, RecipeRecord]
+    model: LpModel
+    class_weight: np.ndarray
+    sp_ratio: np.ndarray
+    effect: np.ndarray
+    x: np.ndarray
+
+    def reusable(self, user_data, use_perfect, theater_id, max_dolls, upgrade_slack):
+        return (
+            self.user_data is user_data
+            and self.use_perfect == use_perfect
+            and self.theater_id == theater_id
+            and max_dolls <= self.max_dolls
+            and (upgrade_slack or not self.upgrade_slack)
+        )
+
+
 class Commander:
     def __init__(
-        self, game_data: GameData, solver: lp.LpSolver, user_data: dict
+        self,
+        game_data: GameData,
+        solver: Union[SolverBackend, lp.LpSolver, str, None],
+        user_data: dict,
+        jobs: int = 1,
+        cache: Optional[ResultCache] = None,
+        data_digest: str = "",
+        data_dir: Optional[Path] = None,
     ) -> None:
         self.game_data = game_data
-        self.solver = solver
+        # where game_data was loaded from (stc/ and table/), for worker processes
+        self.data_dir = None if data_dir is None else Path(data_dir)
+        # a backend, a name in SOLVER_BACKENDS or a pulp solver, see get_backend
+        self.solver = get_backend(solver)
         self.user_data = user_data
+        # processes used to generate recipes, 0 for one per cpu core
+        self.jobs = jobs if jobs > 0 else os.cpu_count()
+        if self.jobs > 1 and self.data_dir is None:
+            logger.warning("Recipes are generated in one process without data_dir")
+            self.jobs = 1
         BaseGameObject.set_gamedata(game_data)
+        # last solve, for warm re-solves with other parameters
+        self.last_solve: Optional[SolveState] = None
+        self.solution: Optional[LpSolution] = None
+        # finished results by content, data_digest identifies the game data
+        self.cache = cache
+        self.data_digest = data_digest
+        self.user_digest = content_hash(user_data) if cache is not None else None
 
     def load_user_info(self) -> Tuple[dict[int, Gun], dict[int, EquipUserRecord]]:
         def gun_priority(gun: Gun):
@@ -159,6 +231,96 @@ class Commander:
             class_weight=class_weight, advantage=advantage, fight_mode=fight_mode
         )
 
+    @staticmethod
+    def equip_stat_vector(equip: Equip, keys: list[str]) -> list[int]:
+        equip_info = equip.equip_info
+        bonus = {
+            s.split(":")[0]: int(s.split(":")[1])
+            for s in equip_info["bonus_type"].split(",")
+            if equip_info["bonus_type"]
+        }
+        vector = [equip_info["skill_effect"], equip_info["skill_effect_per"]]
+        for k in keys:
+            if equip_info[k] == "":
+                vector.append(0)
+                continue
+            modif = 1
+            if k in bonus and equip.equip_level == 10:
+                modif += bonus[k] / 1000
+            vector.append(math.floor(int(equip_info[k].split(",")[1]) * modif))
+        return vector
+
+    @staticmethod
+    def upgrade_slack(
+        user_equip: dict[int, EquipUserRecord],
+        max_dolls: int,
+        upgrade_resource: Optional[int],
+    ) -> bool:
+        # with enough upgrade resource for every equipped slot, upgradable copies
+        # count as +10 copies when checking shortages
+        max_rate = max([e.upgrade for e in user_equip.values()], default=0)
+        return (
+            upgrade_resource is not None
+            and upgrade_resource >= 3 * max_dolls * max_rate
+        )
+
+    @staticmethod
+    def gun_choices(
+        gid: int,
+        gun: Gun,
+        equip_choices: list[list[Equip]],
+        class_weight: int,
+        sp_ratio: float,
+        fairy_ratio: float,
+        night: bool,
+    ) -> tuple[dict[str, RecipeRecord], int]:
+        """Recipes for every valid loadout of one doll, in itertools.product order.
+
+        Loadouts that only reorder the equipments of an earlier one use the same
+        resources for the same effect and are skipped; returns the recipes and
+        the number of skipped loadouts. Static so that it can run in a worker
+        process (see ``jobs``).
+        """
+        recipes: dict[str, RecipeRecord] = {}
+        seen: set[tuple] = set()
+        duplicates = 0
+        for equips in itertools.product(*equip_choices):
+            if len({e.equip_info["type"] for e in equips}) < 3:
+                continue
+            multiset = tuple(sorted((e.equip_id, e.equip_level) for e in equips))
+            if multiset in seen:
+                duplicates += 1
+                continue
+            seen.add(multiset)
+            gun.equips = equips
+            effect = gun.battle_efficiency(
+                night=night,
+                max_eat=True,
+                max_adjust=True,
+                max_favor=True,
+            )
+            score = math.floor(class_weight * (sp_ratio * fairy_ratio * effect / 100))
+
+            e1, e2, e3 = equips
+            recipe_name = (
+                f"r_g{gid}"
+                f"_e{e1.equip_id}_{e1.equip_level}"
+                f"_e{e2.equip_id}_{e2.equip_level}"
+                f"_e{e3.equip_id}_{e3.equip_level}"
+            )
+            recipes[recipe_name] = RecipeRecord(
+                content={
+                    f"g_{gid}": -1,
+                    "count": -1,
+                    "score": score,
+                    f"e{e1.equip_id}_{e1.equip_level}": -1,
+                    f"e{e2.equip_id}_{e2.equip_level}": -1,
+                    f"e{e3.equip_id}_{e3.equip_level}": -1,
+                },
+                info=GunChoiceInfo(gun, equips, effect, score),
+            )
+        return recipes, duplicates
+
     def prepare_choices(
         self,
         user_gun: dict[int, Gun],
@@ -166,11 +328,16 @@ class Commander:
         theater_id: int,
         max_dolls: int,
         fairy_ratio: float,
+        upgrade_resource: Optional[int] = None,
+        prune: bool = True,
+        stats: Optional[dict[str, int]] = None,
     ) -> dict[str, RecipeRecord]:
         theater_config = self.get_theater_config(
             theater_id, self.game_data["theater_area"]
         )
         choices: dict[str, RecipeRecord] = {}
+        stats = {} if stats is None else stats
+        stats.update(candidates=0, pruned=0, duplicates=0)
 
         equip_type_groups: DefaultDict[int, list[EquipUserRecord]] = DefaultDict(list)
         for eid, equip in user_equip.items():
@@ -188,6 +355,14 @@ class Commander:
                     info=equip.lv00_obj,
                 )
 
+        upgrade_slack = self.upgrade_slack(user_equip, max_dolls, upgrade_resource)
+        # copies in the shape of load_user_info records, for prune_dominated
+        equip_copies = {
+            eid: {"level_00": erec.lv00_cnt, "level_10": erec.lv10_cnt}
+            for eid, erec in user_equip.items()
+        }
+        pruned_slots: dict[tuple, list[Equip]] = {}
+        tasks = []
         for gid, gun in user_gun.items():
             gun_info = gun.gun_info
             equip_choices: list[list[Equip]] = []
@@ -206,51 +381,70 @@ class Commander:
                             equippable_equips.append(erec.lv10_obj)
                 equip_choices.append(equippable_equips)
 
-            for equips in itertools.product(*equip_choices):
-                if len({e.equip_info["type"] for e in equips}) < 3:
-                    continue
-                gun.equips = equips
-                effect = gun.battle_efficiency(
-                    night=theater_config["fight_mode"] == "night",
-                    max_eat=True,
-                    max_adjust=True,
-                    max_favor=True,
-                )
-                sp_ratio = 1.2 if gid in theater_config["advantage"] else 1
-                score = math.floor(
-                    theater_config["class_weight"][gun_info["type"] - 1]
-                    * (sp_ratio * fairy_ratio * effect / 100)
+            stats["candidates"] += sum(len(c) for c in equip_choices)
+            if prune:
+                keys = dominance_keys(gun_info, theater_config["fight_mode"])
+                for i, options in enumerate(equip_choices):
+                    pairs = [(e.equip_id, e.equip_level) for e in options]
+                    cache_key = (tuple(pairs), tuple(keys))
+                    if cache_key not in pruned_slots:
+                        kept = prune_dominated(
+                            pairs,
+                            [self.equip_stat_vector(e, keys) for e in options],
+                            [e.equip_info["type"] for e in options],
+                            equip_copies,
+                            max_dolls,
+                            upgrade_slack,
+                        )
+                        pruned_slots[cache_key] = [options[k] for k in kept]
+                    equip_choices[i] = pruned_slots[cache_key]
+                    stats["pruned"] += len(options) - len(equip_choices[i])
+
+            sp_ratio = 1.2 if gid in theater_config["advantage"] else 1
+            tasks.append(
+                (
+                    gid,
+                    gun,
+                    equip_choices,
+                    theater_config["class_weight"][gun_info["type"] - 1],
+                    sp_ratio,
+                    fairy_ratio,
+                    theater_config["fight_mode"] == "night",
                 )
+            )
 
-                e1, e2, e3 = equips
-                recipe_name = (
-                    f"r_g{gid}"
-                    f"_e{e1.equip_id}_{e1.equip_level}"
-                    f"_e{e2.equip_id}_{e2.equip_level}"
-                    f"_e{e3.equip_id}_{e3.equip_level}"
-                )
-                choices[recipe_name] = RecipeRecord(
-                    content={
-                        f"g_{gid}": -1,
-                        "count": -1,
-                        "score": score,
-                        f"e{e1.equip_id}_{e1.equip_level}": -1,
-                        f"e{e2.equip_id}_{e2.equip_level}": -1,
-                        f"e{e3.equip_id}_{e3.equip_level}": -1,
-                    },
-                    info=GunChoiceInfo(gun, equips, effect, score),
+        if self.jobs > 1 and len(tasks) > 1:
+            # dolls are independent; map keeps user_gun order so the merged
+            # choices are the same as the serial ones
+            with ProcessPoolExecutor(
+                self.jobs, initializer=_init_worker, initargs=(self.data_dir,)
+            ) as pool:
+                results = list(
+                    pool.map(
+                        self.gun_choices,
+                        *zip(*tasks),
+                        chunksize=max(1, len(tasks) // (self.jobs * 4)),
+                    )
                 )
+        else:
+            results = [self.gun_choices(*task) for task in tasks]
+        for recipes, duplicates in results:
+            choices.update(recipes)
+            stats["duplicates"] += duplicates
+        logger.info(
+            f"Pruned {stats['pruned']} of {stats['candidates']} equipment candidates, "
+            f"skipped {stats['duplicates']} reordered loadouts"
+        )
         return choices
 
-    def problem_solve(
-        self,
-        choices: dict[str, RecipeRecord],
+    @staticmethod
+    def capacity(
         user_gun: dict[int, Gun],
         user_equip: dict[int, EquipUserRecord],
         max_dolls: int,
         upgrade_resource: int,
-    ) -> tuple[list[Tuple[Equip, int]], list[GunChoiceInfo]]:
-        resource: dict[str, lp.LpAffineExpression] = {}
+    ) -> dict[str, int]:
+        resource: dict[str, int] = {}
         for id in user_gun.keys():
             resource[f"g_{id}"] = 1
         for eid, equip in user_equip.items():
@@ -259,30 +453,61 @@ class Commander:
         resource["count"] = max_dolls
         resource["score"] = 0
         resource["upgrade"] = upgrade_resource
+        return resource
 
-        lp_vars: dict[str, lp.LpVariable] = {}
-        coeff_lp_var_dict = DefaultDict(list)
-        problem = lp.LpProblem("battlefield", lp.LpMaximize)
-        for k, recipe in choices.items():
-            lp_vars[k] = lp.LpVariable(k, cat=lp.LpInteger, lowBound=0)
-            for r, c in recipe.content.items():
-                coeff_lp_var_dict[r].append((lp_vars[k], c))
-        for k, v in coeff_lp_var_dict.items():
-            resource[k] += lp.LpAffineExpression(v)
-        for k, v in resource.items():
-            problem += v >= 0, k
-        problem += (
-            resource["score"] + 0.001 * resource["upgrade"] + 0.001 * resource["e80_10"]
+    def build_model(
+        self,
+        choices: dict[str, RecipeRecord],
+        user_gun: dict[int, Gun],
+        user_equip: dict[int, EquipUserRecord],
+        max_dolls: int,
+        upgrade_resource: int,
+    ) -> LpModel:
+        return LpModel.from_contents(
+            (recipe.content for recipe in choices.values()),
+            self.capacity(user_gun, user_equip, max_dolls, upgrade_resource),
+            {"score": 1, "upgrade": 0.001, "e80_10": 0.001},
         )
 
-        problem.solve(self.solver)
+    def problem_solve(
+        self,
+        choices: dict[str, RecipeRecord],
+        user_gun: dict[int, Gun],
+        user_equip: dict[int, EquipUserRecord],
+        max_dolls: int,
+        upgrade_resource: int,
+        model: Optional[LpModel] = None,
+        start: Optional[np.ndarray] = None,
+    ) -> tuple[list[Tuple[Equip, int]], list[GunChoiceInfo]]:
+        """Solve for choices, or for a given model with the columns of choices.
+
+        start is an earlier optimum passed to the solver as a MIP start; the
+        solution is left in self.solution.
+        """
+        begin = time.perf_counter()
+        if model is None:
+            model = self.build_model(
+                choices, user_gun, user_equip, max_dolls, upgrade_resource
+            )
+        build_time = time.perf_counter() - begin
+
+        solution = self.solver.solve(model, start=start)
+        logger.info(
+            f"{len(choices)} recipes: model built in {build_time:.2f}s, "
+            f"written in {solution.timings['write']:.2f}s, "
+            f"solved in {solution.timings['solve']:.2f}s "
+            f"by {self.solver.name} ({solution.status})"
+        )
+        self.solution = solution
+        scores = model.row_values("score").tolist()
         u_info, g_info = [], []
-        for k, v in lp_vars.items():
-            if v.value() > 0:
+        for j, (k, v) in enumerate(zip(choices, solution.x.tolist())):
+            if v > 0:
                 if k[0] == "u":
-                    u_info.append((choices[k].info, v))
+                    u_info.append((choices[k].info, int(v)))
                 else:
-                    g_info.append(choices[k].info)
+                    # the model may score recipes for another fairy_ratio
+                    g_info.append(replace(choices[k].info, score=int(scores[j])))
         return u_info, g_info
 
     def analyze(
@@ -344,7 +569,7 @@ class Commander:
 
         u_records: list[dict[str, int | str]] = []
         if not use_perfect:
-            equip_counter = {info.equip_id: v.value() for info, v in u_info}
+            equip_counter = {info.equip_id: v for info, v in u_info}
 
         equip_info = self.game_data["equip"]
         for eid, count in equip_counter.items():
@@ -369,18 +594,123 @@ class Commander:
         upgrade_resource: int,
         use_perfect: bool,
     ) -> tuple[list, list]:
+        if self.cache is None:
+            return self._solve(
+                theater_id, fairy_ratio, max_dolls, upgrade_resource, use_perfect
+            )
+        key = self.cache.key(
+            data=self.data_digest,
+            user_info=None if use_perfect else self.user_digest,
+            theater_id=theater_id,
+            max_dolls=max_dolls,
+            fairy_ratio=fairy_ratio,
+            upgrade_resource=upgrade_resource,
+            perfect=use_perfect,
+            solver=self.solver.name,
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            g_records, u_records = cached
+            return g_records, u_records
+        g_records, u_records = self._solve(
+            theater_id, fairy_ratio, max_dolls, upgrade_resource, use_perfect
+        )
+        self.cache.put(key, [g_records, u_records])
+        return g_records, u_records
+
+    def _solve(
+        self,
+        theater_id: int,
+        fairy_ratio: float,
+        max_dolls: int,
+        upgrade_resource: int,
+        use_perfect: bool,
+    ) -> tuple[list, list]:
+        state = self.last_solve
+        if state is not None and state.reusable(
+            self.user_data,
+            use_perfect,
+            theater_id,
+            max_dolls,
+            self.upgrade_slack(state.user_equip, max_dolls, upgrade_resource),
+        ):
+            # same roster and theater: only right-hand sides and scores change
+            model = state.model.with_capacity(
+                self.capacity(
+                    state.user_gun, state.user_equip, max_dolls, upgrade_resource
+                )
+            )
+            if fairy_ratio != state.fairy_ratio:
+                model = model.with_row(
+                    "score",
+                    np.floor(
+                        state.class_weight
+                        * (state.sp_ratio * fairy_ratio * state.effect / 100)
+                    ),
+                )
+            u_info, g_info = self.problem_solve(
+                state.choices,
+                state.user_gun,
+                state.user_equip,
+                max_dolls,
+                upgrade_resource,
+                model=model,
+                start=state.x,
+            )
+            state.model, state.fairy_ratio = model, fairy_ratio
+            state.x = self.solution.x
+            return self.analyze(u_info, g_info, use_perfect)
+
         if use_perfect:
             gun_record, equip_record = self.load_perfect_info()
         else:
             gun_record, equip_record = self.load_user_info()
         choices = self.prepare_choices(
-            gun_record, equip_record, theater_id, max_dolls, fairy_ratio
+            gun_record,
+            equip_record,
+            theater_id,
+            max_dolls,
+            fairy_ratio,
+            upgrade_resource=upgrade_resource,
         )
-        u_info, g_info = self.problem_solve(
+        model = self.build_model(
             choices, gun_record, equip_record, max_dolls, upgrade_resource
         )
-        g_records, u_records = self.analyze(u_info, g_info, use_perfect)
-        return g_records, u_records
+        u_info, g_info = self.problem_solve(
+            choices, gun_record, equip_record, max_dolls, upgrade_resource, model=model
+        )
+        theater_config = self.get_theater_config(
+            theater_id, self.game_data["theater_area"]
+        )
+        class_weight, sp_ratio, effect = [], [], []
+        for k, recipe in choices.items():
+            if k[0] == "u":
+                class_weight.append(0)
+                sp_ratio.append(0)
+                effect.append(0)
+                continue
+            gid = int(k[3:].split("_")[0])
+            gun_type = recipe.info.gun.gun_info["type"]
+            class_weight.append(theater_config["class_weight"][gun_type - 1])
+            sp_ratio.append(1.2 if gid in theater_config["advantage"] else 1)
+            effect.append(recipe.info.effect)
+        self.last_solve = SolveState(
+            user_data=self.user_data,
+            use_perfect=use_perfect,
+            theater_id=theater_id,
+            max_dolls=max_dolls,
+            upgrade_slack=self.upgrade_slack(equip_record, max_dolls, upgrade_resource),
+            fairy_ratio=fairy_ratio,
+            user_gun=gun_record,
+            user_equip=equip_record,
+            choices=choices,
+            model=model,
+            class_weight=np.array(class_weight),
+            sp_ratio=np.array(sp_ratio),
+            effect=np.array(effect),
+            x=self.solution.x,
+        )
+        return self.analyze(u_info, g_info, use_perfect)
 
     def get_assist_unit(
         self, theater_id: int, count: int = 3
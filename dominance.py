@@ -0,0 +1,64 @@
+"""Pruning of equipment options that can never be part of the best loadout.
+
+Shared by the engines of prepare_choices, commander and commander_new, which
+each compute the stat vectors of their options and map the kept ones back.
+"""
+
+
+def dominance_keys(gun, fight_mode):
+    # stats that can change the effect of this doll in this fight mode
+    keys = [
+        "pow",
+        "hit",
+        "dodge",
+        "rate",
+        "critical_harm_rate",
+        "critical_percent",
+        "armor_piercing",
+        "armor",
+    ]
+    if fight_mode == "night":
+        keys.append("night_view_percent")
+    if gun["type"] in [5, 6]:
+        keys.append("bullet_number_up")
+    return keys
+
+
+def prune_dominated(options, vectors, types, user_equip, max_dolls, upgrade_slack):
+    """Indexes of the options of one slot that are kept, in order.
+
+    options are (equip_id, equip_level) pairs, vectors and types their stat
+    vectors and equip types, and user_equip holds the level_00 and level_10
+    counts of every equip_id as load_user_info records do.
+
+    Effect never decreases with any single stat, so an option can be replaced
+    by one of the same type at least as good in every stat. It is only dropped
+    when the dominating options have at least max_dolls copies between them,
+    so a shortage of the better equipment can never make it necessary.
+    """
+
+    def better(i, j):
+        if any(x < y for x, y in zip(vectors[i], vectors[j])):
+            return False
+        # identical stats: keep the option that needs no upgrade
+        (a_id, a_lv), (b_id, b_lv) = options[i], options[j]
+        return vectors[i] != vectors[j] or (a_lv, a_id) < (b_lv, b_id)
+
+    kept = []
+    for j in range(len(options)):
+        levels = {}
+        for i, (eid, elv) in enumerate(options):
+            if i != j and types[i] == types[j] and better(i, j):
+                levels.setdefault(eid, set()).add(elv)
+        supply = 0
+        for eid, lvs in levels.items():
+            my_equip = user_equip[eid]
+            if 0 in lvs:
+                supply += my_equip["level_00"]
+            if 10 in lvs:
+                supply += my_equip["level_10"]
+                if upgrade_slack and 0 not in lvs:
+                    supply += my_equip["level_00"]
+        if supply < max_dolls:
+            kept.append(j)
+    return kept
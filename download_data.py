@@ -1,7 +1,7 @@
+import os
+from contextlib import ExitStack
 from pathlib import Path
 
-from gf_utils import download
-
 REGIONS = ["ch", "kr", "tw", "jp", "us"]
 TABLES = [
     'theater_area', 'squad', 'squad_chip', 'squad_standard_attribution', 'squad_type', 
@@ -9,17 +9,72 @@ TABLES = [
     'squad_cpu_completion', 'sangvis', 'sangvis_advance', 'sangvis_type', 
     'sangvis_resolution', 'gun', 'equip', 'game_config_info', 'gun_type_info'
 ]  # fmt:skip
+DATA_URL = "https://github.com/gf-data-tools/gf-data-{region}/raw/main"
+
 
+def download_data(
+    dir="./data",
+    region="ch",
+    progress=None,
+    downloader=None,
+    base_url=DATA_URL,
+    refresh=False,
+    compress=False,
+):
+    """Download the missing tables of a region, in parallel.
 
-def download_data(dir="./data", region="ch"):
+    With refresh, every table is checked against the server and only changed
+    ones are transferred and replaced, see Downloader.refresh. Validators are
+    kept in data/<region>.download.json. progress(done, total, url) is called
+    after each file; base_url can point to a mirror or a local server.
+
+    With compress, tables are kept as <table>.json.gz, plain tables already
+    downloaded are compressed in place. Without it, a region stays in the
+    form it was first downloaded in; GameData reads both.
+    """
     data_dir = Path(dir)
     data_dir.mkdir(exist_ok=True)
     (data_dir / region).mkdir(exist_ok=True)
+    base_url = base_url.format(region=region)
+    meta_path = data_dir / f"{region}.download.json"
+    # a region is compressed as a whole once any table of it is
+    compress = compress or any((data_dir / region).glob("*.json.gz"))
+    files = []
     for table in TABLES:
-        url = f"https://github.com/gf-data-tools/gf-data-{region}/raw/main/formatted/json/{table}.json"
-        path = data_dir / region / f"{table}.json"
-        if not path.exists():
-            download(url, str(path))
+        plain = data_dir / region / f"{table}.json"
+        packed = plain.with_name(plain.name + ".gz")
+        if compress and plain.exists() and not packed.exists():
+            compress_table(plain, packed, meta_path)
+        path = packed if compress else plain
+        files.append((f"{base_url}/formatted/json/{table}.json", path))
+    # an update that was interrupted is rolled back by the downloader first
+    pending = meta_path.with_name(meta_path.name + ".swap").exists()
+    if not refresh and not pending and all(path.exists() for _, path in files):
+        # nothing to fetch, the http stack is not even imported
+        return [path for _, path in files]
+    from downloader import Downloader
+
+    with ExitStack() as stack:
+        if downloader is None:
+            downloader = stack.enter_context(Downloader())
+        if refresh:
+            return downloader.refresh(files, meta_path, progress)
+        return downloader.download(files, progress, meta_path=meta_path)
+
+
+def compress_table(plain, packed, meta_path):
+    # replace plain by packed, its validators move along so refresh still works
+    from downloader import load_meta, meta_key, save_meta, store_bytes
+
+    tmp = packed.with_name(packed.name + ".tmp")
+    tmp.write_bytes(store_bytes(packed, plain.read_bytes()))
+    os.replace(tmp, packed)
+    plain.unlink()
+    meta = load_meta(meta_path)
+    entry = meta.pop(meta_key(meta_path, plain), None)
+    if entry is not None:
+        meta[meta_key(meta_path, packed)] = entry
+        save_meta(meta_path, meta)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,351 @@
+import gzip
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "GF_Theater_Commander"
+
+
+class DownloadError(Exception):
+    def __init__(self, message, status=None, url=None):
+        super().__init__(message)
+        # HTTP status of the failed response, None for connection errors
+        self.status = status
+        self.url = url
+
+
+class Downloader:
+    """Fetches files in parallel over kept-alive HTTP connections.
+
+    Each of the max_workers threads keeps one connection per host and reuses
+    it for the following files, redirects included. timeout applies to every
+    socket operation of a request, nothing process-wide is changed. One
+    Downloader can serve many download() calls; close(), or leaving it as a
+    context manager, ends the threads and closes every connection.
+    Files are stored gzip-compressed when their path ends with .gz.
+    """
+
+    def __init__(self, max_workers=8, timeout=10, max_retry=5):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retry = max_retry
+        self._local = threading.local()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # every open connection, whichever thread made it, for close()
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+            # threads used after close() start with new connections
+            self._local = threading.local()
+        for conn in connections:
+            conn.close()
+
+    def _connection(self, scheme, netloc):
+        connections = self._local.__dict__.setdefault("connections", {})
+        key = (scheme, netloc)
+        if key not in connections:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            elif scheme == "http":
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise DownloadError(f"unsupported url scheme {scheme!r}")
+            connections[key] = conn
+            with self._connections_lock:
+                self._connections.add(conn)
+        return connections[key]
+
+    def _drop(self, scheme, netloc):
+        conn = self._local.__dict__.get("connections", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+            with self._connections_lock:
+                self._connections.discard(conn)
+
+    def _get(self, url, headers=None, max_redirects=5):
+        # (status, response, body), status is 200 or 304 for conditional requests
+        headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            conn = self._connection(parts.scheme, parts.netloc)
+            target = parts.path + (f"?{parts.query}" if parts.query else "")
+            try:
+                conn.request("GET", target or "/", headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                # a kept-alive connection may have been closed by the server
+                self._drop(parts.scheme, parts.netloc)
+                raise
+            if response.will_close:
+                self._drop(parts.scheme, parts.netloc)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader("Location", ""))
+                continue
+            if response.status not in (200, 304):
+                raise DownloadError(
+                    f"{url}: HTTP {response.status} {response.reason}",
+                    response.status,
+                    url,
+                )
+            return response.status, response, body
+        raise DownloadError(f"{url}: too many redirects", response.status, url)
+
+    def request(self, url, headers=None):
+        # _get retried on connection errors and server errors
+        for i in range(self.max_retry):
+            try:
+                return self._get(url, headers)
+            except (OSError, http.client.HTTPException, DownloadError) as e:
+                if isinstance(e, DownloadError) and (e.status or 500) < 500:
+                    raise
+                if i + 1 == self.max_retry:
+                    raise DownloadError(f"{url}: {e!r}", url=url) from e
+                logger.warning(
+                    f"Failed to download {url} for {i+1}/{self.max_retry} tries"
+                )
+
+    def fetch(self, url) -> bytes:
+        return self.request(url)[2]
+
+    def _stage(self, url, path, entry):
+        """Fetch url for path, conditionally if entry has validators.
+
+        Returns the temporary file holding a changed body, None if path is
+        already up to date, and the metadata entry to keep for path.
+        """
+        headers = {}
+        if entry is not None and entry.get("url") == url and path.exists():
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        status, response, body = self.request(url, headers)
+        if status == 304:
+            return None, entry
+        digest = hashlib.sha256(body).hexdigest()
+        entry = dict(
+            url=url,
+            etag=response.getheader("ETag"),
+            last_modified=response.getheader("Last-Modified"),
+            sha256=digest,
+        )
+        if path.exists() and hashlib.sha256(read_stored(path)).hexdigest() == digest:
+            return None, entry
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(store_bytes(path, body))
+        return tmp, entry
+
+    def _run(self, func, jobs, progress):
+        # func(*job) for every job in the pool, results in job order; the first
+        # failure is raised as a DownloadError once the others have finished
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="Downloader"
+                )
+            futures = {self._pool.submit(func, *job): i for i, job in enumerate(jobs)}
+        results, done, error = [None] * len(jobs), 0, None
+        for future in as_completed(futures):
+            url = jobs[futures[future]][0]
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logger.error(f"Failed to download {url}: {e!r}")
+                if not isinstance(e, DownloadError):
+                    e = DownloadError(f"{url}: {e!r}", url=url)
+                error = error or e
+                continue
+            done += 1
+            logger.info(f"Fetched {url}")
+            if progress is not None:
+                progress(done, len(jobs), url)
+        return results, error
+
+    def download(
+        self, files, progress=None, overwrite=False, meta_path=None
+    ) -> list[Path]:
+        """Download [(url, path)], skipping existing paths unless overwrite.
+
+        progress(done, total, url) is called from the calling thread after
+        each file. The first failure is raised as a DownloadError once the
+        others have finished. With meta_path, the validators of every
+        downloaded file are recorded there for refresh.
+        """
+        files = [(url, Path(path)) for url, path in files]
+        if meta_path is not None:
+            rollback(meta_path)
+        todo = [(url, path) for url, path in files if overwrite or not path.exists()]
+        results, error = self._run(
+            lambda url, path: self._stage(url, path, None), todo, progress
+        )
+        meta = load_meta(meta_path)
+        for (url, path), result in zip(todo, results):
+            if result is not None:
+                tmp, entry = result
+                if tmp is not None:
+                    os.replace(tmp, path)
+                if meta_path is not None:
+                    meta[meta_key(meta_path, path)] = entry
+        save_meta(meta_path, meta)
+        if error is not None:
+            raise error
+        return [path for _, path in files]
+
+    def refresh(self, files, meta_path, progress=None) -> list[Path]:
+        """Bring [(url, path)] up to date, returning the paths that changed.
+
+        Files with recorded validators are requested conditionally, so an
+        unchanged file costs one small request. Changed files are staged
+        next to their targets and only moved into place once every request
+        has succeeded; on failure nothing is replaced. The changed files and
+        the metadata are then swapped in as one set, see swap.
+        """
+        files = [(url, Path(path)) for url, path in files]
+        rollback(meta_path)
+        meta = load_meta(meta_path)
+        results, error = self._run(
+            lambda url, path: self._stage(
+                url, path, meta.get(meta_key(meta_path, path))
+            ),
+            files,
+            progress,
+        )
+        if error is not None:
+            for result in results:
+                if result is not None and result[0] is not None:
+                    result[0].unlink(missing_ok=True)
+            raise error
+        staged = []
+        for (url, path), (tmp, entry) in zip(files, results):
+            if tmp is not None:
+                staged.append((path, tmp))
+            meta[meta_key(meta_path, path)] = entry
+        meta_path = Path(meta_path)
+        tmp = meta_path.with_name(meta_path.name + ".tmp")
+        write_json(tmp, meta)
+        swap(staged + [(meta_path, tmp)], meta_path)
+        return [path for path, _ in staged]
+
+
+def store_bytes(path, body) -> bytes:
+    # what is written for body at path; mtime=0 keeps equal bodies identical
+    if Path(path).suffix == ".gz":
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    return body
+
+
+def read_stored(path) -> bytes:
+    # the body stored at path, see store_bytes
+    raw = Path(path).read_bytes()
+    return gzip.decompress(raw) if Path(path).suffix == ".gz" else raw
+
+
+def meta_key(meta_path, path):
+    return os.path.relpath(path, Path(meta_path).parent).replace(os.sep, "/")
+
+
+def load_meta(meta_path) -> dict:
+    # {path relative to the metadata file: {url, etag, last_modified, sha256}},
+    # sha256 is of the body as served, compressed files included
+    if meta_path is None:
+        return {}
+    try:
+        return json.loads(Path(meta_path).read_text("utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_meta(meta_path, meta):
+    if meta_path is None:
+        return
+    meta_path = Path(meta_path)
+    tmp = meta_path.with_name(meta_path.name + ".tmp")
+    write_json(tmp, meta)
+    os.replace(tmp, meta_path)
+
+
+def write_json(path, value):
+    Path(path).write_text(json.dumps(value, indent=1, sort_keys=True), "utf-8")
+
+
+def swap_journal(meta_path) -> Path:
+    return Path(meta_path).with_name(Path(meta_path).name + ".swap")
+
+
+def swap(staged, meta_path):
+    """Move every staged [(path, tmp)] into place, all of them or none.
+
+    Replaced files are kept as <path>.old and the swap is listed in a journal
+    next to meta_path until the last file is in place. The journal counts the
+    files whose move has started, so only those are undone. A swap that fails
+    is rolled back at once, one that was interrupted by the next rollback().
+    """
+    names = [[meta_key(meta_path, path), path.exists()] for path, _ in staged]
+    # left by a swap that was interrupted after it finished; never restored
+    for path, _ in staged:
+        path.with_name(path.name + ".old").unlink(missing_ok=True)
+    journal = swap_journal(meta_path)
+    try:
+        for started, (path, tmp) in enumerate(staged, 1):
+            _write_journal(journal, names, started)
+            if path.exists():
+                os.replace(path, path.with_name(path.name + ".old"))
+            os.replace(tmp, path)
+    except BaseException:
+        rollback(meta_path)
+        raise
+    journal.unlink()
+    for path, _ in staged:
+        path.with_name(path.name + ".old").unlink(missing_ok=True)
+
+
+def _write_journal(journal, names, started):
+    tmp = journal.with_name(journal.name + ".tmp")
+    write_json(tmp, {"files": names, "started": started})
+    os.replace(tmp, journal)
+
+
+def rollback(meta_path) -> bool:
+    # undo a swap that did not finish, True if there was one
+    journal = swap_journal(meta_path)
+    journal.with_name(journal.name + ".tmp").unlink(missing_ok=True)
+    try:
+        entries = json.loads(journal.read_text("utf-8"))
+    except FileNotFoundError:
+        return False
+    files, started = entries["files"], entries["started"]
+    for i, (name, existed) in enumerate(files):
+        path = Path(meta_path).parent / name
+        if i < started:
+            old = path.with_name(path.name + ".old")
+            if old.exists():
+                os.replace(old, path)
+            elif not existed:
+                path.unlink(missing_ok=True)
+        path.with_name(path.name + ".tmp").unlink(missing_ok=True)
+    journal.unlink()
+    logger.warning(f"Rolled back an unfinished update of {started} files")
+    return True
@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+import numpy as np
+
+from attr_calc import EQUIP_VECTOR_KEYS, equip_vector
+from game_columns import STAT_KEYS
+from gf_utils import GameData
+
+
+def parse_equip_stat(equip):
+    # {"pow": {"min": 7, "max": 10, "upgrade": 500}, ...} from the raw "min,max" columns
+    stat = {}
+    bonus = {
+        s.split(":")[0]: int(s.split(":")[1])
+        for s in equip["bonus_type"].split(",")
+        if equip["bonus_type"]
+    }
+    for k in STAT_KEYS:
+        if equip[k] != "":
+            smin, smax = [int(i) for i in equip[k].split(",")]
+            stat[k] = dict(min=smin, max=smax)
+            if k in bonus:
+                stat[k]["upgrade"] = bonus[k]
+    return stat
+
+
+def _readonly(array):
+    array.setflags(write=False)
+    return array
+
+
+@dataclass(frozen=True)
+class EquipTable:
+    """Equipment stats compiled once from the equip table.
+
+    Rows follow ``ids``; ``stat_00``/``stat_10`` hold the +0/+10 bonus of each
+    equipment in EQUIP_VECTOR_KEYS order (the last column is skill_effect_per,
+    the one before it skill_effect). Every field is read-only, so one table can
+    be shared by concurrent solves.
+    """
+
+    ids: tuple[int, ...]
+    row: Mapping[int, int]
+    type: np.ndarray
+    rank: np.ndarray
+    upgrade: np.ndarray  # upgrade cost, -1 if the equipment has no upgrade bonus
+    fit_guns: tuple[frozenset[int], ...]
+    stat_00: np.ndarray
+    stat_10: np.ndarray
+
+    @classmethod
+    def compile(cls, equip_info) -> "EquipTable":
+        ids, types, ranks, upgrades, fit_guns, stat_00, stat_10 = ([] for _ in range(7))
+        for eid, equip in equip_info.items():
+            parsed = dict(
+                stat=parse_equip_stat(equip),
+                skill_effect=equip["skill_effect"],
+                skill_effect_per=equip["skill_effect_per"],
+            )
+            ids.append(eid)
+            types.append(equip["type"])
+            ranks.append(equip["rank"])
+            upgrades.append(-1 if not equip["bonus_type"] else equip["exclusive_rate"])
+            fit_guns.append(
+                frozenset(int(i) for i in equip["fit_guns"].split(","))
+                if equip["fit_guns"]
+                else frozenset()
+            )
+            stat_00.append(equip_vector(parsed, 0))
+            stat_10.append(equip_vector(parsed, 10))
+        shape = (len(ids), len(EQUIP_VECTOR_KEYS))
+        return cls(
+            ids=tuple(ids),
+            row=MappingProxyType({eid: i for i, eid in enumerate(ids)}),
+            type=_readonly(np.array(types, dtype=np.int64)),
+            rank=_readonly(np.array(ranks, dtype=np.int64)),
+            upgrade=_readonly(np.array(upgrades, dtype=np.int64)),
+            fit_guns=tuple(fit_guns),
+            stat_00=_readonly(np.array(stat_00, dtype=np.int64).reshape(shape)),
+            stat_10=_readonly(np.array(stat_10, dtype=np.int64).reshape(shape)),
+        )
+
+    def vector(self, eid, elv) -> np.ndarray:
+        return (self.stat_10 if elv == 10 else self.stat_00)[self.row[eid]]
+
+    def equip_type(self, eid) -> int:
+        return int(self.type[self.row[eid]])
+
+    def fits(self, eid, gid) -> bool:
+        fit_guns = self.fit_guns[self.row[eid]]
+        return not fit_guns or gid in fit_guns
+
+
+def get_equip_table(game_data) -> EquipTable:
+    if isinstance(game_data, GameData):
+        return game_data.compiled(
+            "equip_table", lambda data: EquipTable.compile(data["equip"])
+        )
+    return EquipTable.compile(game_data["equip"])
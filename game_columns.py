@@ -0,0 +1,57 @@
+"""Fields of the game data tables the engine reads.
+
+Kept apart from the modules using them, which import numpy, so that GameData
+can be opened with GAME_DATA_COLUMNS without it.
+"""
+
+# equip stats, the raw "min,max" columns parsed by parse_equip_stat
+STAT_KEYS = [
+    "pow",
+    "hit",
+    "dodge",
+    "speed",
+    "rate",
+    "critical_harm_rate",
+    "critical_percent",
+    "armor_piercing",
+    "armor",
+    "shield",
+    "damage_amplify",
+    "damage_reduction",
+    "night_view_percent",
+    "bullet_number_up",
+]
+
+# gun fields read by doll_attr_calculate_batch, all a worker needs of a gun row
+GUN_KEYS = [
+    "id",
+    "type",
+    "rank",
+    "crit",
+    "armor_piercing",
+    "special",
+    "eat_ratio",
+    "ratio_life",
+    "ratio_pow",
+    "ratio_rate",
+    "ratio_hit",
+    "ratio_dodge",
+    "ratio_armor",
+]
+
+# every field of the gun and equip tables the engine and its output read, for
+# GameData(columns=...)
+GAME_DATA_COLUMNS = {
+    "gun": GUN_KEYS
+    + ["name", "rank_display", "type_equip1", "type_equip2", "type_equip3"],
+    "equip": STAT_KEYS
+    + ["name", "type", "rank", "code", "is_show", "bonus_type", "exclusive_rate"]
+    + ["fit_guns", "skill_effect", "skill_effect_per"],
+}
+
+# the fields the CLI output shows, carried by a solve result (see
+# sweep.team_result) so that a cached one renders without the tables
+DISPLAY_COLUMNS = {
+    "gun": ["name", "type", "rank_display"],
+    "equip": ["name", "type", "rank", "exclusive_rate"],
+}
@@ -1,16 +1,21 @@
 # %%
+import gzip
+import hashlib
 import json
 import logging
 import os
-import socket
-from collections.abc import MutableMapping
+import pickle
+import tempfile
+import threading
+from array import array
+from collections.abc import Mapping, MutableMapping
 from pathlib import Path
-from socket import timeout
-from urllib import request
-from urllib.error import URLError
 
 logger = logging.getLogger(__name__)
 
+# bump when the layout of snapshot files changes
+SNAPSHOT_VERSION = 1
+
 # %%
 special_keys = {
     "achievement": "identity",
@@ -47,33 +52,214 @@ special_keys = {
 }
 
 
+def table_files(stc_dir) -> dict:
+    """{table: path} of a data dir, tables stored as .json or .json.gz."""
+    files = {p.name[:-8]: p for p in Path(stc_dir).glob("*.json.gz")}
+    files.update((p.name[:-5], p) for p in Path(stc_dir).glob("*.json"))
+    return files
+
+
+class Record(Mapping):
+    """One row of a ProjectedTable, read from its columns on access."""
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._table.columns[key][self._index]
+
+    def __iter__(self):
+        return iter(self._table.columns)
+
+    def __len__(self):
+        return len(self._table.columns)
+
+    def __repr__(self):
+        return f"Record({dict(self)!r})"
+
+
+class ProjectedTable(Mapping):
+    """A keyed table with only some of its columns, stored column by column.
+
+    ``table[id][field]`` works as with the dict of dicts it replaces, for the
+    kept fields. Integer columns are arrays, others lists; rows are Record
+    views made on access, so no per-row dict is kept.
+    """
+
+    def __init__(self, rows, columns):
+        self.index = {key: i for i, key in enumerate(rows)}
+        self.columns = {}
+        for column in columns:
+            values = [row.get(column) for row in rows.values()]
+            if all(type(v) is int for v in values):
+                try:
+                    values = array("q", values)
+                except OverflowError:
+                    pass
+            self.columns[column] = values
+
+    def __getitem__(self, key):
+        return Record(self, self.index[key])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
 class GameData(MutableMapping):
-    def __init__(self, stc_dir, to_dict=True) -> None:
+    def __init__(self, stc_dir, to_dict=True, snapshot=True, columns=None) -> None:
         self.stc_dir = Path(stc_dir)
         self.to_dict = to_dict
-        self.__keys = [p.name[:-5] for p in self.stc_dir.glob("*.json")]
+        # {table: fields}, these tables are loaded as ProjectedTable
+        self.columns = {k: tuple(v) for k, v in (columns or {}).items()}
+        # parsed tables are kept as pickles in data/<region>.snapshot
+        self.snapshot_dir = (
+            self.stc_dir.with_name(self.stc_dir.name + ".snapshot")
+            if snapshot
+            else None
+        )
+        self.__files = table_files(self.stc_dir)
         self.__data = {}
+        self.__compiled = {}
+        # one lock per table or compiled name, so each is built once
+        self.__lock = threading.Lock()
+        self.__locks = {}
+
+    def __key_lock(self, key):
+        with self.__lock:
+            return self.__locks.setdefault(key, threading.RLock())
 
     def __get_stc_dict(self, name):
-        logger.debug(f"Reading {name}.json")
-        with (self.stc_dir / f"{name}.json").open("r", encoding="utf-8") as f:
-            data = json.load(f)
-            if self.to_dict and len(data) > 0:
-                k = (
-                    "id"
-                    if "id" in data[0].keys()
-                    else (special_keys[name] if name in special_keys.keys() else None)
-                )
-                if k is not None:
-                    data = {d[k]: d for d in data}
+        path = self.__files[name]
+        columns = self.columns.get(name)
+        snapshot_name = name
+        if columns is not None:
+            digest = hashlib.sha256(json.dumps(columns).encode()).hexdigest()
+            snapshot_name = f"{name}-{digest[:12]}"
+        if self.snapshot_dir is not None:
+            data = self.__read_snapshot(snapshot_name, path)
+            if data is not None:
+                return data
+        logger.debug(f"Reading {path.name}")
+        raw = path.read_bytes()
+        # compressed tables are hashed as stored and inflated in memory
+        text = gzip.decompress(raw) if path.suffix == ".gz" else raw
+        data = json.loads(text.decode("utf-8"))
+        if self.to_dict and len(data) > 0:
+            k = (
+                "id"
+                if "id" in data[0].keys()
+                else (special_keys[name] if name in special_keys.keys() else None)
+            )
+            if k is not None:
+                data = {d[k]: d for d in data}
+        if columns is not None and isinstance(data, dict):
+            data = ProjectedTable(data, columns)
+        if self.snapshot_dir is not None:
+            digest = hashlib.sha256(raw).hexdigest()
+            self.__write_snapshot(snapshot_name, path, digest, data)
+        return data
+
+    def __snapshot_header(self, path, digest):
+        stat = path.stat()
+        return dict(
+            version=SNAPSHOT_VERSION,
+            to_dict=self.to_dict,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            sha256=digest,
+        )
+
+    def __read_snapshot(self, name, path):
+        """The table as parsed last time, None if the json has changed since.
+
+        A snapshot is a pickled header followed by the pickled table. Size and
+        mtime decide quickly; if only the mtime differs, the content hash does.
+        """
+        try:
+            with (self.snapshot_dir / f"{name}.pickle").open("rb") as f:
+                header = pickle.load(f)
+                stat = path.stat()
+                if (
+                    header.get("version") != SNAPSHOT_VERSION
+                    or header["to_dict"] != self.to_dict
+                    or header["size"] != stat.st_size
+                ):
+                    return None
+                fresh = header["mtime_ns"] == stat.st_mtime_ns
+                if not fresh:
+                    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+                    if digest != header["sha256"]:
+                        return None
+                logger.debug(f"Reading {name} snapshot")
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            return None
+        if not fresh:
+            self.__write_snapshot(name, path, digest, data)
         return data
 
+    def __write_snapshot(self, name, path, digest, data):
+        # write then rename, a snapshot is complete or absent
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.snapshot_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self.__snapshot_header(path, digest), f)
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.snapshot_dir / f"{name}.pickle")
+        except OSError as e:
+            logger.debug(f"Could not write {name} snapshot: {e!r}")
+
     def __getitem__(self, key):
-        if key not in self.__keys:
+        if key not in self.__files:
             raise KeyError(key)
-        if key not in self.__data:
-            self.__data[key] = self.__get_stc_dict(key)
-        return self.__data[key]
+        data = self.__data
+        if key not in data:
+            with self.__key_lock(("table", key)):
+                if key not in data:
+                    data[key] = self.__get_stc_dict(key)
+        return data[key]
+
+    def reload(self):
+        """Forget loaded tables and everything compiled from them."""
+        with self.__lock:
+            self.__files = table_files(self.stc_dir)
+            self.__data = {}
+            self.__compiled = {}
+
+    def compiled(self, name, builder):
+        """Return builder(self), built on first use and shared by later callers."""
+        compiled = self.__compiled
+        if name not in compiled:
+            with self.__key_lock(("compiled", name)):
+                if name not in compiled:
+                    logger.debug(f"Compiling {name}")
+                    compiled[name] = builder(self)
+        return compiled[name]
+
+    def prefetch(self, names=("gun", "equip", "theater_area")) -> threading.Thread:
+        """Start loading tables in a background thread and return it.
+
+        Later lookups of a table being loaded wait for it instead of parsing
+        it again; errors are left for them to raise.
+        """
+
+        def load():
+            for name in names:
+                try:
+                    self[name]
+                except Exception as e:
+                    logger.debug(f"Prefetching {name} failed: {e!r}")
+
+        thread = threading.Thread(target=load, name="GameData.prefetch", daemon=True)
+        thread.start()
+        return thread
 
     def __getattr__(self, k):
         return self[k]
@@ -88,13 +274,17 @@ class GameData(MutableMapping):
         pass
 
     def __iter__(self):
-        return iter(self.__keys)
+        return iter(self.__files)
 
     def __len__(self):
-        return len(self.__keys)
+        return len(self.__files)
 
 
 def download(url, path, max_retry=10, timeout_sec=5):
+    # network modules are only imported here, GameData doesn't need them
+    import socket
+    from urllib import request
+
     socket.setdefaulttimeout(timeout_sec)
     fname = os.path.split(path)[-1]
     logger.info(f"Start downloading {fname}")
@@ -0,0 +1,100 @@
+import codecs
+import importlib.util
+import json
+import locale
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# utf-32-le before utf-16-le, whose BOM it starts with
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def _orjson_loads():
+    import orjson
+
+    return orjson.loads
+
+
+def _msgspec_loads():
+    import msgspec
+
+    return msgspec.json.decode
+
+
+# fastest first, each a function returning loads(str | bytes)
+JSON_BACKENDS = {
+    "orjson": _orjson_loads,
+    "msgspec": _msgspec_loads,
+    "json": lambda: json.loads,
+}
+
+
+def json_backend(name=None) -> str:
+    """name if given, else the first of JSON_BACKENDS that is installed."""
+    if name is not None:
+        if name != "json" and importlib.util.find_spec(name) is None:
+            raise ImportError(f"the {name} json backend is not installed")
+        return name
+    return next(
+        name
+        for name in JSON_BACKENDS
+        if name == "json" or importlib.util.find_spec(name) is not None
+    )
+
+
+def decode_text(raw: bytes, encodings=()) -> str:
+    """raw as text: by its BOM, as UTF-8, or in the first encoding that fits.
+
+    The fallback encodings are for exports saved in a legacy code page;
+    the preferred encoding of the locale is tried last.
+    """
+    for bom, encoding in BOMS:
+        if raw.startswith(bom):
+            return raw.decode(encoding)
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError as e:
+        error = e
+    for encoding in dict.fromkeys([*encodings, locale.getpreferredencoding()]):
+        try:
+            text = raw.decode(encoding)
+        except (UnicodeDecodeError, LookupError) as e:
+            logger.warning(e)
+            continue
+        logger.info(f"Decoded as {encoding}")
+        return text
+    raise error
+
+
+def parse_json(raw: bytes, encodings=(), backend=None):
+    """Parse json bytes, see decode_text for their encoding.
+
+    UTF-8 without a BOM, what GFAlarm writes, goes to the parser as bytes
+    and is not decoded separately; other input is decoded once before.
+    backend picks one of JSON_BACKENDS, by default the fastest installed.
+    """
+    loads = JSON_BACKENDS[json_backend(backend)]()
+    if not raw.startswith(tuple(bom for bom, _ in BOMS)):
+        try:
+            return loads(raw)
+        except Exception:
+            # errors of valid UTF-8 are in the json itself, decoding won't help
+            try:
+                raw.decode("utf-8")
+            except UnicodeDecodeError:
+                pass
+            else:
+                raise
+    return loads(decode_text(raw, encodings))
+
+
+def read_json(path, encodings=(), backend=None):
+    return parse_json(Path(path).read_bytes(), encodings, backend)
@@ -1,32 +1,43 @@
-import pandas as pd
+GUN_FIELDS = ['gun_id','gun_level','skill1','skill2','number','favor']
 
 def load_user_info(user_info:dict, game_data:dict):
+    """Best value of every field per doll, level 0 and 10 counts per 5-star equip.
+
+    One pass over the records of a GFAlarm export; the results are keyed and
+    ordered by raw gun id and equip id. Fields missing from a record count as 0.
+    """
     gun_info, equip_info = game_data['gun'], game_data['equip']
     gun_user, equip_user = user_info['gun_with_user_info'], user_info['equip_with_user_info']
-    
-    gun_user_df = pd.DataFrame.from_records(gun_user).reindex(columns=['gun_id','gun_level','skill1','skill2','number','favor'])
-    for c in gun_user_df.columns:
-        gun_user_df[c] = pd.to_numeric(gun_user_df[c])
-    gun_user_df['raw_gun_id'] = gun_user_df['gun_id'] % 20000
-    gun_user_df['favor'] = gun_user_df['favor'] // 10000
-    gun_user_df_agg = gun_user_df.groupby('raw_gun_id').agg(max)
-    gun_user_df_agg['name'] = gun_user_df_agg['gun_id'].map(lambda idx: gun_info[idx]['name'])
-    gun_user_record = gun_user_df_agg.to_dict(orient='index')
 
-    equip_user_df = pd.DataFrame.from_dict(equip_user,orient='index').reindex(columns=['equip_id','equip_level'])
-    for c in equip_user_df.columns:
-        equip_user_df[c] = pd.to_numeric(equip_user_df[c])
-    equip_user_df['equip_level'] = equip_user_df['equip_level'].map(lambda x: 0 if x<10 else 10)
-    equip_user_df['level_10'] = equip_user_df['equip_level'].map(lambda x: 1 if x==10 else 0)
-    equip_user_df['level_00'] = equip_user_df['equip_level'].map(lambda x: 0 if x==10 else 1)
-    equip_user_df_agg = equip_user_df.groupby(['equip_id']).agg(sum).reset_index().drop(columns=['equip_level'])
-    equip_user_df_agg['name'] = equip_user_df_agg['equip_id'].map(lambda idx: equip_info[idx]['name'])
-    equip_user_df_agg['rank'] = equip_user_df_agg['equip_id'].map(lambda idx: equip_info[idx]['rank'])
-    equip_user_df_agg['upgrade'] = equip_user_df_agg['equip_id'].map(lambda idx: -1 if not equip_info[idx]['bonus_type'] else int(equip_info[idx]['exclusive_rate']))
-    equip_user_df_agg['fit_guns'] = equip_user_df_agg['equip_id'].map(lambda idx: [int(i) for i in equip_info[idx]['fit_guns'].split(',')] if equip_info[idx]['fit_guns'] else [])
-    equip_user_df_agg = equip_user_df_agg.query('rank==5').set_index('equip_id',drop=False)
-    equip_user_record = equip_user_df_agg.to_dict(orient='index')
-    
+    gun_best = {}
+    for record in gun_user:
+        values = [int(record.get(k, 0)) for k in GUN_FIELDS]
+        values[5] //= 10000
+        best = gun_best.get(values[0] % 20000)
+        # each field on its own, as several copies of a doll can be listed
+        gun_best[values[0] % 20000] = values if best is None else list(map(max, best, values))
+    gun_user_record = {}
+    for idx in sorted(gun_best):
+        gun_user_record[idx] = dict(zip(GUN_FIELDS, gun_best[idx]), name=gun_info[gun_best[idx][0]]['name'])
+
+    equip_count = {}
+    for record in equip_user.values():
+        counts = equip_count.setdefault(int(record['equip_id']), [0, 0])
+        counts[int(record['equip_level']) >= 10] += 1
+    equip_user_record = {}
+    for idx in sorted(equip_count):
+        equip = equip_info[idx]
+        if equip['rank'] != 5:
+            continue
+        equip_user_record[idx] = {
+            'equip_id': idx,
+            'level_10': equip_count[idx][1],
+            'level_00': equip_count[idx][0],
+            'name': equip['name'], 'rank': equip['rank'],
+            'upgrade': -1 if not equip['bonus_type'] else int(equip['exclusive_rate']),
+            'fit_guns': [int(i) for i in equip['fit_guns'].split(',')] if equip['fit_guns'] else []
+        }
+
     return gun_user_record, equip_user_record
 
 def load_perfect_info(game_data:dict):
@@ -0,0 +1,403 @@
+import abc
+import importlib.util
+import os
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+
+# first word of a CBC solution file
+CBC_STATUS = {
+    "Optimal": "Optimal",
+    "Infeasible": "Infeasible",
+    "Integer": "Infeasible",
+    "Unbounded": "Unbounded",
+    "Stopped": "Not Solved",
+}
+
+
+@dataclass
+class LpSolution:
+    status: str
+    x: np.ndarray
+    objective: float
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class LpModel:
+    """Integer program ``max weight @ (capacity + A @ x)`` subject to
+    ``capacity + A @ x >= 0`` and integer ``x >= 0``.
+
+    Rows are resources and columns are recipes. A is stored by column as CSR
+    arrays, the way RecipeTable stores recipes and the order MPS lists them
+    in, so no expression objects are built for a solve.
+    """
+
+    rows: tuple[str, ...]
+    capacity: np.ndarray
+    weight: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+
+    @classmethod
+    def from_recipes(cls, choices, capacity, weight) -> "LpModel":
+        # choices: RecipeTable; capacity and weight: {resource name: value}
+        rows = list(choices.resources)
+        rows += [name for name in capacity if name not in choices.resource_id]
+        return cls(
+            rows=tuple(rows),
+            capacity=np.array([capacity.get(r, 0) for r in rows], dtype=np.float64),
+            weight=np.array([weight.get(r, 0) for r in rows], dtype=np.float64),
+            indptr=choices.indptr,
+            indices=choices.indices,
+            data=choices.data,
+        )
+
+    @classmethod
+    def from_contents(cls, contents, capacity, weight) -> "LpModel":
+        # contents: one {resource name: coefficient} per recipe
+        row_id = {name: i for i, name in enumerate(capacity)}
+        indptr, indices, data = [0], [], []
+        for content in contents:
+            for name, c in content.items():
+                indices.append(row_id.setdefault(name, len(row_id)))
+                data.append(c)
+            indptr.append(len(indices))
+        rows = list(row_id)
+        return cls(
+            rows=tuple(rows),
+            capacity=np.array([capacity.get(r, 0) for r in rows], dtype=np.float64),
+            weight=np.array([weight.get(r, 0) for r in rows], dtype=np.float64),
+            indptr=np.array(indptr, dtype=np.int64),
+            indices=np.array(indices, dtype=np.int32),
+            data=np.array(data, dtype=np.float64),
+        )
+
+    @property
+    def num_columns(self) -> int:
+        return len(self.indptr) - 1
+
+    @cached_property
+    def columns(self) -> np.ndarray:
+        # column of each entry of indices/data
+        return np.repeat(np.arange(self.num_columns), np.diff(self.indptr))
+
+    @cached_property
+    def objective(self) -> np.ndarray:
+        return np.bincount(
+            self.columns,
+            weights=self.weight[self.indices] * self.data,
+            minlength=self.num_columns,
+        )
+
+    @property
+    def objective_constant(self) -> float:
+        return float(self.weight @ self.capacity)
+
+    def row_id(self, name) -> int:
+        return self.rows.index(name)
+
+    def row_values(self, name) -> np.ndarray:
+        # coefficient of every column in one row, 0 where it is not used
+        entries = self.indices == self.row_id(name)
+        values = np.zeros(self.num_columns)
+        values[self.columns[entries]] = self.data[entries]
+        return values
+
+    def with_capacity(self, capacity) -> "LpModel":
+        # same recipes with new right-hand sides, {resource name: value}
+        model = replace(
+            self,
+            capacity=np.array([capacity.get(r, 0) for r in self.rows], np.float64),
+        )
+        # nothing derived from the coefficients changes, keep it
+        for name in ["columns", "objective", "mps_columns"]:
+            if name in self.__dict__:
+                model.__dict__[name] = self.__dict__[name]
+        return model
+
+    def with_row(self, name, values) -> "LpModel":
+        """Same model with the coefficients of one row replaced.
+
+        values has one entry per column; columns that do not use the row keep
+        not using it.
+        """
+        entries = self.indices == self.row_id(name)
+        data = self.data.astype(np.float64)
+        data[entries] = np.asarray(values, dtype=np.float64)[self.columns[entries]]
+        return replace(self, data=data)
+
+    def activity(self, x) -> np.ndarray:
+        # capacity + A @ x, what is left of every resource
+        return self.capacity + np.bincount(
+            self.indices,
+            weights=self.data * np.asarray(x, dtype=np.float64)[self.columns],
+            minlength=len(self.rows),
+        )
+
+    @cached_property
+    def mps_columns(self) -> str:
+        """ROWS and COLUMNS sections of the MPS file, which only depend on the
+        coefficients; models that differ in capacity share them."""
+        column_names = [f"{'X%d' % j:<8}" for j in range(self.num_columns)]
+        row_names = [f"{'R%d' % r:<8}" for r in range(len(self.rows))] + ["OBJ     "]
+        # objective entries go last in each column
+        obj = np.flatnonzero(self.objective)
+        entry_columns = np.concatenate([self.columns, obj])
+        order = np.argsort(entry_columns, kind="stable")
+        entry_columns = entry_columns[order].tolist()
+        entry_rows = np.concatenate([self.indices, np.full(len(obj), len(self.rows))])
+        entry_rows = entry_rows[order].tolist()
+        values = np.concatenate([self.data, self.objective[obj]])[order].tolist()
+        # coefficients repeat a lot, format each once
+        formatted = {v: f"{v: .12e}" for v in set(values)}
+        return "".join(
+            [
+                "ROWS\n N  OBJ\n",
+                *(f" G  R{r}\n" for r in range(len(self.rows))),
+                "COLUMNS\n    MARK      'MARKER'                 'INTORG'\n",
+                *(
+                    f"    {column_names[j]}  {row_names[r]}  {formatted[v]}\n"
+                    for j, r, v in zip(entry_columns, entry_rows, values)
+                ),
+                "    MARK      'MARKER'                 'INTEND'\n",
+            ]
+        )
+
+    def write_mps(self, path):
+        """Write the model as fixed-format MPS with rows R{i} and columns X{j}.
+
+        Fields are padded the way pulp pads them, CBC reads the file by column.
+        """
+        with open(path, "w", buffering=1 << 20) as f:
+            f.write("NAME          MODEL\n")
+            f.write(self.mps_columns)
+            f.write("RHS\n")
+            f.writelines(
+                f"    RHS       {'R%d' % r:<8}  {-c: .12e}\n"
+                for r, c in enumerate(self.capacity.tolist())
+                if c != 0
+            )
+            # integer columns without bounds would be read as binary
+            f.write("BOUNDS\n")
+            f.writelines(
+                f" LO BND       {'X%d' % j:<8}  {0: .12e}\n"
+                for j in range(self.num_columns)
+            )
+            f.write("ENDATA\n")
+
+    def solution(self, status, x, timings) -> LpSolution:
+        x = np.asarray(x, dtype=np.float64)
+        objective = float(self.objective @ x) + self.objective_constant
+        return LpSolution(status, x, objective, timings)
+
+    def write_start(self, path, x):
+        # a CBC solution file for the mips command, every column listed
+        with open(path, "w", buffering=1 << 20) as f:
+            f.write("Stopped on time - objective value 0\n")
+            f.writelines(
+                f"{j:>7} X{j} {v:>15} {0:>23}\n" for j, v in enumerate(x.tolist())
+            )
+
+    def solve_cbc(self, path, msg=False, start=None) -> LpSolution:
+        """Solve with the CBC executable at path through an MPS file.
+
+        start is a solution of an earlier, similar model passed to CBC as a
+        MIP start; CBC repairs or drops it if it no longer fits.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            mps, sol = os.path.join(tmp, "model.mps"), os.path.join(tmp, "model.sol")
+            commands = ["max"]
+            begin = time.perf_counter()
+            self.write_mps(mps)
+            if start is not None:
+                self.write_start(os.path.join(tmp, "start.sol"), start)
+                # the start is the incumbent, no need to search for one
+                commands += ["mips", os.path.join(tmp, "start.sol")]
+                commands += ["heuristicsOnOff", "off"]
+            written = time.perf_counter()
+            subprocess.run(
+                [path, mps, *commands, "branch", "solution", sol],
+                stdout=None if msg else subprocess.DEVNULL,
+                stderr=None if msg else subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL,
+                check=True,
+            )
+            solved = time.perf_counter()
+            x = np.zeros(self.num_columns)
+            with open(sol) as f:
+                status = CBC_STATUS.get(f.readline().split()[0], "Undefined")
+                for line in f:
+                    words = line.split()
+                    if words and words[0] == "**":
+                        words = words[1:]
+                    if len(words) >= 3 and words[1][0] == "X":
+                        x[int(words[1][1:])] = float(words[2])
+        timings = dict(write=written - begin, solve=solved - written)
+        return self.solution(status, np.round(x), timings)
+
+    def solve_pulp(self, solver=None) -> LpSolution:
+        """Solve through pulp, by default with pulp's own CBC."""
+        import pulp as lp
+
+        start = time.perf_counter()
+        problem = lp.LpProblem("battlefield", lp.LpMaximize)
+        lp_vars = [
+            lp.LpVariable(f"x{j}", cat=lp.LpInteger, lowBound=0)
+            for j in range(self.num_columns)
+        ]
+        order = np.argsort(self.indices, kind="stable")
+        row_ptr = np.searchsorted(self.indices[order], np.arange(len(self.rows) + 1))
+        columns, data = self.columns[order].tolist(), self.data[order].tolist()
+        for r, c in enumerate(self.capacity.tolist()):
+            span = range(row_ptr[r], row_ptr[r + 1])
+            expr = lp.LpAffineExpression([(lp_vars[columns[i]], data[i]) for i in span])
+            problem += expr + c >= 0, f"R{r}"
+        problem += lp.LpAffineExpression(
+            [(lp_vars[j], c) for j, c in enumerate(self.objective.tolist()) if c != 0]
+        )
+        built = time.perf_counter()
+        problem.solve(solver or lp.PULP_CBC_CMD(msg=0))
+        solved = time.perf_counter()
+        timings = dict(write=built - start, solve=solved - built)
+        x = [v.value() or 0 for v in lp_vars]
+        return self.solution(lp.LpStatus[problem.status], np.round(x), timings)
+
+    def solve_highs(self, msg=False, mip_rel_gap=0.0, start=None) -> LpSolution:
+        """Solve in-process with HiGHS, handing it the CSR arrays as they are.
+
+        HiGHS stops at a 1e-4 relative gap by default; mip_rel_gap=0 proves
+        optimality like CBC does, so both backends return the same score.
+        start, as for solve_cbc, is handed to HiGHS as a starting solution.
+        """
+        import highspy
+
+        begin = time.perf_counter()
+        highs = highspy.Highs()
+        highs.setOptionValue("output_flag", bool(msg))
+        highs.setOptionValue("mip_rel_gap", mip_rel_gap)
+        # presolve takes seconds on these wide models and removes almost nothing
+        highs.setOptionValue("presolve", "off")
+        model = highspy.HighsLp()
+        model.num_col_ = self.num_columns
+        model.num_row_ = len(self.rows)
+        model.sense_ = highspy.ObjSense.kMaximize
+        model.col_cost_ = self.objective
+        model.col_lower_ = np.zeros(self.num_columns)
+        model.col_upper_ = np.full(self.num_columns, highspy.kHighsInf)
+        model.row_lower_ = -self.capacity
+        model.row_upper_ = np.full(len(self.rows), highspy.kHighsInf)
+        model.integrality_ = [highspy.HighsVarType.kInteger] * self.num_columns
+        model.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        model.a_matrix_.start_ = self.indptr
+        model.a_matrix_.index_ = self.indices
+        model.a_matrix_.value_ = self.data.astype(np.float64)
+        highs.passModel(model)
+        if start is not None:
+            solution = highspy.HighsSolution()
+            solution.col_value = np.asarray(start, dtype=np.float64)
+            solution.value_valid = True
+            highs.setSolution(solution)
+        built = time.perf_counter()
+        highs.run()
+        solved = time.perf_counter()
+        status = highs.modelStatusToString(highs.getModelStatus())
+        x = np.array(highs.getSolution().col_value)
+        if len(x) != self.num_columns:
+            x = np.zeros(self.num_columns)
+        timings = dict(write=built - begin, solve=solved - built)
+        return self.solution(status, np.round(x), timings)
+
+
+class SolverBackend(abc.ABC):
+    """One way of solving an LpModel, chosen by name with get_backend."""
+
+    name = ""
+
+    @abc.abstractmethod
+    def solve(self, model: LpModel, start=None) -> LpSolution:
+        # start: a solution of a similar model to warm start from, if supported
+        ...
+
+
+class CbcBackend(SolverBackend):
+    """The CBC executable, by default the one bundled in solverdir."""
+
+    name = "cbc"
+
+    def __init__(self, path=None, msg=False):
+        self.path = str(path or bundled_cbc_path())
+        self.msg = msg
+
+    def solve(self, model, start=None):
+        return model.solve_cbc(self.path, msg=self.msg, start=start)
+
+
+class HighsBackend(SolverBackend):
+    """HiGHS through highspy, without temp files or a subprocess."""
+
+    name = "highs"
+
+    def __init__(self, msg=False, mip_rel_gap=0.0):
+        if importlib.util.find_spec("highspy") is None:
+            raise ImportError("the highs solver backend needs highspy")
+        self.msg = msg
+        self.mip_rel_gap = mip_rel_gap
+
+    def solve(self, model, start=None):
+        return model.solve_highs(
+            msg=self.msg, mip_rel_gap=self.mip_rel_gap, start=start
+        )
+
+
+class PulpBackend(SolverBackend):
+    """Any pulp solver, going through pulp's own model building."""
+
+    name = "pulp"
+
+    def __init__(self, solver=None):
+        self.solver = solver
+
+    def solve(self, model, start=None):
+        # pulp only warm starts some of its solvers, start is not used
+        return model.solve_pulp(self.solver)
+
+
+SOLVER_BACKENDS = {b.name: b for b in [CbcBackend, HighsBackend, PulpBackend]}
+
+
+def bundled_cbc_path(root=None) -> Path:
+    import pulp as lp
+
+    return (
+        Path(root or Path(__file__).resolve().parent)
+        / "solverdir"
+        / "cbc"
+        / lp.operating_system
+        / lp.arch
+        / lp.LpSolver_CMD.executableExtension("cbc")
+    )
+
+
+def get_backend(solver=None) -> SolverBackend:
+    """A backend from a name in SOLVER_BACKENDS, a pulp solver or a backend.
+
+    COIN_CMD solvers keep their executable but skip pulp's model building.
+    """
+    if solver is None:
+        return CbcBackend()
+    if isinstance(solver, SolverBackend):
+        return solver
+    if isinstance(solver, str):
+        return SOLVER_BACKENDS[solver]()
+    import pulp as lp
+
+    if isinstance(solver, lp.COIN_CMD) and solver.path:
+        return CbcBackend(solver.path, msg=solver.msg)
+    return PulpBackend(solver)
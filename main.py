@@ -1,15 +1,10 @@
-import json
 import locale
 import logging
-import os
-import shutil
-import socket
 import tkinter as tk
 import tkinter.ttk as ttk
 from base64 import standard_b64decode, standard_b64encode
 from functools import partial, wraps
 from gettext import install
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from threading import RLock, Thread
 from tkinter.filedialog import askopenfilename
@@ -17,43 +12,21 @@ from tkinter.messagebox import showerror, showinfo
 from tkinter.scrolledtext import ScrolledText
 from tkinter.simpledialog import Dialog
 from typing import *
-from urllib import request
 from urllib.error import HTTPError
 
 import pulp as lp
 from gf_utils2.gamedata import GameData
 
 from commander_new.commander import Commander
+from downloader import Downloader
 from gunframe import GunFrame
+from json_reader import read_json
+from result_cache import ResultCache
 
 logger = logging.getLogger(__name__)
 __version__ = "12.0.5"
 
 
-def download(url, path, max_retry=3, timeout_sec=5):
-    socket.setdefaulttimeout(timeout_sec)
-    fname = os.path.split(path)[-1]
-    logger.info(f"Start downloading {fname}")
-    for i in range(max_retry):
-        try:
-            if not os.path.exists(path):
-                request.urlretrieve(url, path + ".tmp")
-                os.rename(path + ".tmp", path)
-        except Exception as e:
-            if i + 1 < max_retry:
-                logger.warning(
-                    f"Failed to download {fname} for {i+1}/{max_retry} tries"
-                )
-                continue
-            else:
-                logger.exception(repr(e))
-                raise
-        else:
-            logger.info(f"Successfully downloaded {fname}")
-            break
-    return path
-
-
 def menu_from_dict(
     master: tk.Widget, options: dict, var_key: tk.Variable, var_value: tk.Variable
 ):
@@ -113,8 +86,12 @@ class TheaterCommander(tk.Tk):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.lock = RLock()
+        # one pool of kept-alive connections for every data download
+        self.downloader = Downloader(max_workers=8)
+        self.result_cache = ResultCache(Path(__file__).resolve().parent / "cache")
         self.setup()
         self.user_data = None
+        self.commander = None
         self.g_records = None
         self.u_records = None
 
@@ -267,14 +244,9 @@ class TheaterCommander(tk.Tk):
     @locked
     def download_data(self, region="ch", re_download=False):
         data_dir = Path(__file__).resolve().parent / f"data/{region}"
-        tmp_dir = Path(__file__).resolve().parent / f"data/tmp"
-        if tmp_dir.exists():
-            shutil.rmtree(tmp_dir)
-        os.makedirs(tmp_dir)
         (data_dir / "stc").mkdir(parents=True, exist_ok=True)
         (data_dir / "table").mkdir(parents=True, exist_ok=True)
         try:
-            pool = ThreadPool(processes=24)
             stc_names = [
                 'equip', 'game_config_info', 'gun', 'gun_type_info', 'sangvis', 
                 'sangvis_advance', 'sangvis_character_type', 'sangvis_resolution', 
@@ -297,7 +269,7 @@ class TheaterCommander(tk.Tk):
                 "theater_area",
             ]
 
-            task_params = []
+            files = []
             base_url = f"https://github.com/gf-data-tools/gf-data-{region}/raw/main"
 
             for table in stc_names:
@@ -305,40 +277,13 @@ class TheaterCommander(tk.Tk):
                     url = f"{base_url}/catchdata/{table}.json"
                 else:
                     url = f"{base_url}/stc/{table}.json"
-                tmp_path = tmp_dir / f"{table}.json"
-                tgt_path = data_dir / f"stc/{table}.json"
-                task_params.append((url, tmp_path, tgt_path))
+                files.append((url, data_dir / f"stc/{table}.json"))
 
             for table in txt_names:
                 url = f"{base_url}/asset/table/{table}.txt"
-                tmp_path = tmp_dir / f"{table}.txt"
-                tgt_path = data_dir / f"table/{table}.txt"
-                task_params.append((url, tmp_path, tgt_path))
-
-            cnt = 0
-            tot = len(stc_names) + len(txt_names)
-            self.title(
-                _("战区计算器")
-                + f"v{__version__}"
-                + _(" - 更新数据")
-                + f"({cnt}/{tot})"
-            )
+                files.append((url, data_dir / f"table/{table}.txt"))
 
-            def update(url, tmp_path, tgt_path):
-                try:
-                    if not tgt_path.exists() or re_download:
-                        download(url, str(tmp_path))
-                        if tgt_path.exists():
-                            os.remove(tgt_path)
-                        tmp_path.rename(tgt_path)
-                    return url, None
-                except Exception as e:
-                    return url, e
-
-            for url, ret in pool.imap_unordered(lambda p: update(*p), task_params):
-                if isinstance(ret, Exception):
-                    raise ret
-                cnt += 1
+            def update(cnt, tot, *_):
                 self.title(
                     _("战区计算器")
                     + f"v{__version__}"
@@ -346,16 +291,25 @@ class TheaterCommander(tk.Tk):
                     + f"({cnt}/{tot})"
                 )
 
+            # validators of every file, to re-download only what changed
+            meta_path = data_dir.with_name(f"{region}.download.json")
+            if re_download:
+                self.downloader.refresh(files, meta_path, progress=update)
+            else:
+                self.downloader.download(files, progress=update, meta_path=meta_path)
         except Exception as e:
             showerror(
                 title=_("下载数据失败"),
-                message=_("下载 {} 失败").format(url) + f"\n{repr(e)}",
+                message=_("下载 {} 失败").format(getattr(e, "url", ""))
+                + f"\n{repr(e)}",
             )
             raise
         else:
             if re_download:
                 showinfo(title=_("完成下载"), message="数据已更新")
             self.gamedata = GameData(data_dir / "stc", data_dir / "table")
+            self.data_dir = data_dir
+            self.data_digest = self.result_cache.data_digest(data_dir)
             print(list(self.gamedata.keys()))
         finally:
             self.title(_("战区计算器") + f"v{__version__}")
@@ -383,14 +337,21 @@ class TheaterCommander(tk.Tk):
         return opt_stage
 
     def read_file(self):
+        fname = askopenfilename(filetypes=[("JSON", "*.json")])
+        if fname:
+            # large exports are parsed off the main thread
+            self.lbl_upload_status.config(text="...", fg="black")
+            self.btn_calculate.config(state="disabled")
+            Thread(
+                target=self.load_user_file, args=(fname, self.var_encoding.get())
+            ).start()
+
+    def load_user_file(self, fname, encoding):
         try:
-            fname = askopenfilename(filetypes=[("JSON", "*.json")])
-            if fname:
-                self.user_data = json.load(
-                    Path(fname).open("r", encoding=self.var_encoding.get())
-                )
-                self.lbl_upload_status.config(text=_("完成"), fg="green")
-                self.btn_calculate.config(state="normal")
+            # UTF-8 unless the file has a BOM or only decodes as encoding
+            self.user_data = read_json(fname, [encoding])
+            self.lbl_upload_status.config(text=_("完成"), fg="green")
+            self.btn_calculate.config(state="normal")
         except Exception as e:
             self.lbl_upload_status.config(text=_("失败"), fg="red")
             self.btn_calculate.config(state="disabled")
@@ -462,7 +423,22 @@ class TheaterCommander(tk.Tk):
         )
         solver = lp.COIN_CMD(msg=0, path=str(lp_bin))
 
-        commander = Commander(self.gamedata, solver, self.user_data)
+        # keep the commander while data and user info stay the same, so that
+        # changing only the doll count, upgrades or fairies re-solves warm
+        commander = self.commander
+        if (
+            commander is None
+            or commander.game_data is not self.gamedata
+            or commander.user_data is not self.user_data
+        ):
+            commander = self.commander = Commander(
+                self.gamedata,
+                solver,
+                self.user_data,
+                cache=self.result_cache,
+                data_digest=self.data_digest,
+                data_dir=self.data_dir,
+            )
 
         self.assist_units = (
             []
@@ -514,4 +490,6 @@ class TheaterCommander(tk.Tk):
 
 if __name__ == "__main__":
     window = TheaterCommander()
-    window.mainloop()
+    # the downloader keeps connections open between downloads
+    with window.downloader:
+        window.mainloop()
@@ -1,35 +1,24 @@
 # %%
+# only the standard library is imported up front: every stage of main imports
+# what it needs, so --help and cached results skip numpy and the solvers
 import argparse
-import json
-import locale
 import logging
+import multiprocessing
 import os
-import re
 import shutil
-from collections import defaultdict
+import time
 from pathlib import Path
 
-import pulp as lp
-from rich import box
-from rich.console import CONSOLE_HTML_FORMAT, Console
-from rich.logging import RichHandler
-from rich.status import Status
-from rich.table import Column, Table
-from rich.terminal_theme import MONOKAI
+logger = logging.getLogger()
 
-from download_data import download_data
-from gf_utils import GameData
-from load_user_info import load_perfect_info, load_user_info
-from prepare_choices import prepare_choices
 
-logger = logging.getLogger()
+def sweep_range(spec):
+    # sweep.sweep_range, imported with numpy only when the option is given
+    from sweep import sweep_range
+
+    return sweep_range(spec)
+
 
-console = Console(record=True)
-logging.basicConfig(
-    format="%(message)s",
-    handlers=[RichHandler(console=console, show_time=False, show_path=False)],
-)
-os.chdir(Path(__file__).resolve().parent)
 # %% argparse
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -40,13 +29,23 @@ parser.add_argument(
     action="store_true",
     help="删除现有数据文件，强制重新下载"
 )
+parser.add_argument(
+    "-U", "--update_data",
+    action="store_true",
+    help="检查数据更新，只下载有变化的文件"
+)
+parser.add_argument(
+    "-z", "--compress_data",
+    action="store_true",
+    help="以gzip压缩保存数据文件，已下载的文件也会被压缩"
+)
 parser.add_argument(
     "-e",
     "--encoding",
     type=str,
     nargs="*",
     default=["utf-8", "gbk"],
-    help="用于读取user_info的编码，默认仅尝试utf-8和gbk",
+    help="user_info不是UTF-8时依次尝试的编码，默认为gbk",
 )
 parser.add_argument("-m", "--max_dolls", type=int, default=30, help="上场人数")
 parser.add_argument(
@@ -76,225 +75,513 @@ parser.add_argument(
     default=Path("./info/user_info.json"),
     help="自定义用户数据路径"
 )
-args = parser.parse_known_args()[0]
+parser.add_argument(
+    "-j", "--jobs",
+    type=int,
+    default=1,
+    help="生成配装方案的进程数，0表示使用全部CPU核心"
+)
+parser.add_argument(
+    "-s", "--solver",
+    choices=["cbc", "highs", "pulp"],  # lp_model.SOLVER_BACKENDS
+    default="cbc",
+    help="求解器，cbc为自带的CBC，highs需要安装highspy"
+)
+parser.add_argument(
+    "-b", "--best_first",
+    action="store_true",
+    help="按得分从高到低生成配装方案，确定不再需要时提前停止"
+)
+parser.add_argument(
+    "--sweep_dolls",
+    type=sweep_range,
+    help="扫描上场人数，格式为start:stop[:step]，如10:30:5",
+)
+parser.add_argument(
+    "--sweep_upgrade",
+    type=sweep_range,
+    help="扫描强化资源量，格式同上，如0:100:10",
+)
+parser.add_argument(
+    "--stages",
+    type=int,
+    nargs="*",
+    help="批量求解多个关卡，不指定id时为theater_id所在期的全部要塞关卡",
+)
+parser.add_argument(
+    "--batch",
+    type=Path,
+    nargs="+",
+    help="批量求解多个账号的user_info文件或其所在目录，结果保存到-o指定的目录",
+)
+parser.add_argument(
+    "--no_cache",
+    action="store_true",
+    help="不使用也不保存缓存的计算结果",
+)
+parser.add_argument(
+    "-o", "--output",
+    type=Path,
+    help="扫描或批量求解结果的保存路径，.json或.csv；--batch时为保存目录",
+)
+parser.add_argument(
+    "--timings",
+    action="store_true",
+    help="输出各阶段导入模块与运行的耗时",
+)
+
+
+class StageTimer:
+    """Wall time of each stage of a run, its imports apart, for --timings."""
+
+    def __init__(self):
+        self.times = {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage, part="run"):
+        # the time since the previous lap, added to stage's import or run time
+        now = time.perf_counter()
+        times = self.times.setdefault(stage, {"import": 0.0, "run": 0.0})
+        times[part] += now - self.last
+        self.last = now
+
+    def report(self):
+        print(f"{'stage':<12}{'import':>10}{'run':>10}")
+        for stage, times in self.times.items():
+            print(
+                f"{stage:<12}{times['import'] * 1000:8.1f}ms"
+                f"{times['run'] * 1000:8.1f}ms"
+            )
+        total = [
+            sum(t[part] for t in self.times.values()) for part in ["import", "run"]
+        ]
+        print(f"{'total':<12}{total[0] * 1000:8.1f}ms{total[1] * 1000:8.1f}ms")
+
+
+def get_solver(name):
+    from lp_model import CbcBackend, PulpBackend, bundled_cbc_path, get_backend
+
+    if name != "cbc":
+        return get_backend(name)
+    lp_bin = bundled_cbc_path(os.getcwd())
+    if lp_bin.exists():
+        return CbcBackend(lp_bin)
+    logger.warning(f"{lp_bin} not found, solving with pulp's default solver")
+    return PulpBackend()
+
+
 # %% Start
-with Status("Initializing", console=console, spinner="bouncingBar") as status:
-    # %% 战区关卡参数
-    theater_id = args.theater_id
-    fairy_ratio = args.fairy_ratio  # 妖精加成：5星1.25
-    max_dolls = args.max_dolls  # 上场人数
-    region = args.region  # 服务器
-    use_perfect = args.perfect  # 完美梯队
-    upgrade_resource = (
-        args.upgrade_resource if not use_perfect else 999
-    )  # 可以用于强化的资源量（普通装备消耗1份，专属消耗3份）
-
-    # %%
-    status.update("Downloading data")
-    if args.delete_data:
-        shutil.rmtree("./data")
-    download_data(dir="./data", region=region)
-    game_data = GameData(f"data/{region}")
-    gun_info, equip_info = game_data["gun"], game_data["equip"]
-
-    status.update("Reading user info")
-    if use_perfect:
-        user_gun, user_equip = load_perfect_info(game_data)
-    else:
-        user_info_file = args.input
-        encoding_options = {*args.encoding, locale.getpreferredencoding()}
-        for encoding in encoding_options:
-            try:
-                data = user_info_file.read_text(encoding=encoding)
-            except UnicodeDecodeError as e:
-                logger.warning(e)
+def main(args, timer=None):
+    timer = timer or StageTimer()
+    from rich import box
+    from rich.console import Console
+    from rich.logging import RichHandler
+    from rich.status import Status
+    from rich.table import Column, Table
+
+    console = Console(record=True)
+    logging.basicConfig(
+        format="%(message)s",
+        handlers=[RichHandler(console=console, show_time=False, show_path=False)],
+    )
+    timer.lap("output", "import")
+    with Status("Initializing", console=console, spinner="bouncingBar") as status:
+        # %% 战区关卡参数
+        theater_id = args.theater_id
+        fairy_ratio = args.fairy_ratio  # 妖精加成：5星1.25
+        max_dolls = args.max_dolls  # 上场人数
+        region = args.region  # 服务器
+        use_perfect = args.perfect  # 完美梯队
+        upgrade_resource = (
+            args.upgrade_resource if not use_perfect else 999
+        )  # 可以用于强化的资源量（普通装备消耗1份，专属消耗3份）
+        sweep_dolls = args.sweep_dolls or [max_dolls]
+        sweep_upgrade = args.sweep_upgrade or [upgrade_resource]
+        sweeping = args.sweep_dolls is not None or args.sweep_upgrade is not None
+        if sweeping:
+            # recipes for the most dolls and the least upgrades fit every point
+            max_dolls, upgrade_resource = max(sweep_dolls), min(sweep_upgrade)
+
+        # %%
+        status.update("Downloading data")
+        from download_data import download_data
+        from game_columns import GAME_DATA_COLUMNS
+        from gf_utils import GameData
+
+        timer.lap("data", "import")
+        if args.delete_data:
+            shutil.rmtree("./data")
+        download_data(
+            dir="./data",
+            region=region,
+            progress=lambda done, total, _: status.update(
+                f"Downloading data ({done}/{total})"
+            ),
+            refresh=args.update_data,
+            compress=args.compress_data,
+        )
+        game_data = GameData(f"data/{region}", columns=GAME_DATA_COLUMNS)
+        timer.lap("data", "run")
+
+        if args.batch is not None:
+            if use_perfect or sweeping or args.stages is not None:
+                parser.error("--batch cannot be combined with -p, --sweep_* or --stages")
+            from prepare_choices import get_theater_config
+            from sweep import account_files, solve_batch, write_table
+
+            timer.lap("batch", "import")
+            # fail before starting the workers if theater_id is no fortress stage
+            get_theater_config(theater_id, game_data["theater_area"])
+            files = account_files(args.batch)
+            out_dir = args.output or Path("./batch")
+            table = solve_batch(
+                files,
+                f"data/{region}",
+                out_dir,
+                theater_id,
+                max_dolls,
+                fairy_ratio,
+                upgrade_resource,
+                get_solver(args.solver),
+                args.encoding,
+                jobs=os.cpu_count() if args.jobs <= 0 else args.jobs,
+                progress=lambda done, total, _: status.update(
+                    f"Solving accounts ({done}/{total})"
+                ),
+            )
+            write_table(table, out_dir / "summary.csv")
+            timer.lap("batch", "run")
+            status.update("Done")
+            batch_table = Table(
+                "账号", "总效能", "使用人数", "消耗强化", "配装方案", "求解",
+                box=box.SIMPLE,
+            )
+            for row in table:
+                if "error" in row:
+                    batch_table.add_row(row["account"], f"[red]{row['error']}")
+                    continue
+                batch_table.add_row(
+                    row["account"],
+                    *(str(row[k]) for k in ["score", "dolls", "upgrades", "recipes"]),
+                    f"{row['solve']:.2f}s",
+                )
+            console.print(batch_table)
+            logger.info(f"{len(files)} accounts saved to {out_dir}")
+            timer.lap("output", "run")
+            return
+
+        status.update("Reading user info")
+        if not use_perfect:
+            from json_reader import parse_json
+
+            timer.lap("user info", "import")
+            # read once, UTF-8 unless it has a BOM or only decodes as args.encoding
+            data = args.input.read_bytes()
+            user_info = parse_json(data, args.encoding)
+            timer.lap("user info", "run")
+        # identical requests are answered from the cache, before any table is read
+        cache = result = None
+        if not (args.no_cache or sweeping or args.stages is not None):
+            from gf_utils import table_files
+            from result_cache import ResultCache, content_hash
+
+            timer.lap("cache", "import")
+            cache = ResultCache("./cache")
+            cache_key = cache.key(
+                # the tables only, what the GUI keeps under data/<region> is not read
+                data=cache.data_digest(*table_files(f"data/{region}").values()),
+                user_info=None if use_perfect else content_hash(data),
+                theater_id=theater_id,
+                max_dolls=max_dolls,
+                fairy_ratio=fairy_ratio,
+                upgrade_resource=upgrade_resource,
+                perfect=use_perfect,
+                # the team can differ between solvers and enumeration modes
+                solver=args.solver,
+                best_first=args.best_first,
+            )
+            result = cache.get(cache_key)
+            timer.lap("cache", "run")
+        cached = result is not None
+        if result is None:
+            # parse the big tables while the rest is imported
+            game_data.prefetch()
+            from load_user_info import load_perfect_info, load_user_info
+            from prepare_choices import (
+                get_theater_config,
+                get_theater_stages,
+                prepare_choices,
+            )
+
+            timer.lap("recipes", "import")
+            stages = None
+            if args.stages is not None:
+                theater_area = game_data["theater_area"]
+                stages = {
+                    id: get_theater_config(id, theater_area)
+                    for id in args.stages
+                    or get_theater_stages(theater_area, theater_id // 100)
+                }
+                if args.best_first:
+                    logger.warning(
+                        "--best_first depends on the stage, ignored with --stages"
+                    )
+                    args.best_first = False
+            if use_perfect:
+                user_gun, user_equip = load_perfect_info(game_data)
             else:
-                user_info = json.loads(data)
-                break
+                user_gun, user_equip = load_user_info(user_info, game_data)
+            status.update("Forming problem")
+            stats = {}
+            choices = prepare_choices(
+                user_gun,
+                user_equip,
+                theater_id,
+                max_dolls,
+                fairy_ratio,
+                game_data,
+                upgrade_resource=upgrade_resource,
+                stats=stats,
+                jobs=args.jobs,
+                best_first=args.best_first,
+                fight_modes=stages and {c["fight_mode"] for c in stages.values()},
+            )
+            timer.lap("recipes", "run")
+
+            # %%
+            status.update(
+                f"Solving ({len(choices)} recipes, "
+                f"{stats['pruned']}/{stats['candidates']} equipment candidates pruned, "
+                f"{stats['duplicates']} reordered loadouts skipped)"
+            )
+            from lp_model import LpModel
+            from recipe_table import recipe_capacity
+            from sweep import solve_stages, sweep, team_result, write_table
+
+            backend = get_solver(args.solver)
+            timer.lap("solve", "import")
+            if sweeping:
+                table = sweep(
+                    choices, user_gun, user_equip, sweep_dolls, sweep_upgrade, backend
+                )
+                timer.lap("solve", "run")
+                if args.output is not None:
+                    write_table(table, args.output)
+                status.update("Done")
+                sweep_table = Table(
+                    "上场人数", "强化资源", "总效能", "使用人数", "消耗强化", "求解",
+                    box=box.SIMPLE,
+                )
+                for row in table:
+                    sweep_table.add_row(
+                        *(str(row[k]) for k in ["max_dolls", "upgrade_resource", "score"]),
+                        *(str(row[k]) for k in ["dolls", "upgrades"]),
+                        f"{row.get('solve', 0):.2f}s",
+                    )
+                console.print(sweep_table)
+                timer.lap("output", "run")
+                return
+            if stages is not None:
+                table = solve_stages(
+                    choices,
+                    recipe_capacity(user_gun, user_equip, max_dolls, upgrade_resource),
+                    stages,
+                    game_data["gun"],
+                    fairy_ratio,
+                    backend,
+                    jobs=os.cpu_count() if args.jobs <= 0 else args.jobs,
+                )
+                timer.lap("solve", "run")
+                if args.output is not None:
+                    write_table(table, args.output)
+                status.update("Done")
+                stage_table = Table(
+                    "关卡", "昼夜", "总效能", "使用人数", "消耗强化", "出战人形",
+                    box=box.SIMPLE,
+                )
+                for row in table:
+                    stage_table.add_row(
+                        str(row["theater_id"]),
+                        "昼战" if row["fight_mode"] == "day" else "夜战",
+                        *(str(row[k]) for k in ["score", "dolls", "upgrades"]),
+                        " ".join(game_data["gun"][gid]["name"] for gid in row["team"]),
+                    )
+                console.print(stage_table)
+                timer.lap("output", "run")
+                return
+
+            resource = recipe_capacity(user_gun, user_equip, max_dolls, upgrade_resource)
+            start = time.perf_counter()
+            model = LpModel.from_recipes(choices, resource, {"score": 1, "upgrade": 0.001})
+            build_time = time.perf_counter() - start
+
+            solution = backend.solve(model)
+            result = team_result(choices, model, solution, user_gun, game_data)
+            result["timings"]["build"] = build_time
+            result["backend"] = backend.name
+            if cache is not None:
+                cache.put(cache_key, result)
+            timer.lap("solve", "run")
+        # %%
+        status.update("Done")
+        if console.width < 60:
+            console.width = 1000
+        box_per_row = min(5, (console.width - 10) // 25)
+
+        u_info, g_info = result["u_info"], result["g_info"]
+        gun_info, equip_info = (
+            {int(i): row for i, row in result[f"{table}_info"].items()}
+            for table in ["gun", "equip"]
+        )
+        u_info.sort(
+            key=lambda x: 0.001 * x[1] - equip_info[x[0]["eid"]]["exclusive_rate"],
+            reverse=True,
+        )
+        if not args.type_sort:
+            g_info.sort(key=lambda x: x[0]["score"], reverse=True)
         else:
-            raise RuntimeError(
-                "Failed to open user_info.json with all encoding options"
+            g_info.sort(
+                key=lambda x: (gun_info[int(x[0]["gid"])]["type"], int(x[0]["gid"]))
             )
-        user_gun, user_equip = load_user_info(user_info, game_data)
-    status.update("Forming problem")
-    choices = prepare_choices(
-        user_gun, user_equip, theater_id, max_dolls, fairy_ratio, game_data
-    )
 
-    # %%
-    status.update("Solving")
-    resource = {}
-    for id, _ in user_gun.items():
-        resource[f"g_{id}"] = 1
-    for eid, equip in user_equip.items():
-        resource[f"e{eid}_10"] = equip["level_10"]
-        resource[f"e{eid}_0"] = equip["level_00"]
-    resource["count"] = max_dolls
-    resource["score"] = 0
-    resource["upgrade"] = upgrade_resource
-    lp_vars = {}
-    coeff_lp_var_dict = defaultdict(list)
-    problem = lp.LpProblem("battlefield", lp.LpMaximize)
-    for k, recipe in choices.items():
-        lp_vars[k] = lp.LpVariable(k, cat=lp.LpInteger, lowBound=0)
-        for r, c in recipe["content"].items():
-            # build a dict with value as lists of (coefficient, LpVar) tuples before building LpAffineExpression in bulk
-            # else doing += coefficient*LpVar would trigger significantly amount of costly LpAffineExpression.__init__ call
-            coeff_lp_var_dict[r].append((lp_vars[k], c))
-    for k, v in coeff_lp_var_dict.items():
-        resource[k] += lp.LpAffineExpression(v)
-    for k, v in resource.items():
-        problem += v >= 0, k
-    problem += resource["score"] + 0.001 * resource["upgrade"]
-
-    lp_bin: Path = (
-        Path(os.getcwd())
-        / "solverdir"
-        / "cbc"
-        / lp.operating_system
-        / lp.arch
-        / lp.LpSolver_CMD.executableExtension("cbc")
-    )
-    problem.solve(lp.COIN_CMD(msg=0, path=str(lp_bin)))
-    # %%
-    status.update("Done")
-    if console.width < 60:
-        console.width = 1000
-    box_per_row = min(5, (console.width - 10) // 25)
-
-    u_info, g_info = [], []
-    for k, v in lp_vars.items():
-        if v.value() > 0:
-            if k[0] == "u":
-                u_info.append([choices[k]["info"], v])
-            else:
-                g_info.append([choices[k]["info"], v])
-    u_info.sort(
-        key=lambda x: 0.001 * v.value() - equip_info[x[0]["eid"]]["exclusive_rate"],
-        reverse=True,
-    )
-    if not args.type_sort:
-        g_info.sort(key=lambda x: x[0]["score"], reverse=True)
-    else:
-        g_info.sort(
-            key=lambda x: (gun_info[int(x[0]["gid"])]["type"], int(x[0]["gid"]))
+        rank_color = {
+            1: "magenta",
+            2: "white",
+            3: "cyan",
+            4: "green",
+            5: "yellow",
+            6: "red",
+            7: "magenta",
+        }
+        lv_color = {
+            0: "grey",
+            1: "white",
+            2: "white",
+            3: "cyan",
+            4: "cyan",
+            5: "cyan",
+            6: "green",
+            7: "green",
+            8: "green",
+            9: "yellow",
+            10: "yellow",
+        }
+
+        equip_list = []
+        for i, (info, v) in enumerate(u_info):
+            if i % 5 == 0:
+                equip_table = Table.grid(
+                    Column("name", width=17, justify="right"),
+                    Column("value", width=5, justify="left"),
+                    padding=(0, 1, 0, 0),
+                )
+            ename, erank = (
+                equip_info[info["eid"]]["name"],
+                6
+                if equip_info[info[f"eid"]]["type"] in [18, 19, 20]
+                else equip_info[info["eid"]]["rank"],
+            )
+            equip_table.add_row(f"[{rank_color[erank]}]{ename}", f"{v:2.0f}")
+            if (i + 1) % 5 == 0 or i + 1 == len(u_info):
+                equip_list.append(equip_table)
+
+        strn_table = Table(
+            show_header=False,
+            show_lines=True,
+            box=box.SQUARE,
+            padding=(0, 0, 0, 0),
+            title="强化装备",
+            title_justify="left",
         )
+        for i in range(0, len(equip_list), box_per_row):
+            strn_table.add_row(*equip_list[i : min(i + box_per_row, len(equip_list))])
 
-    rank_color = {
-        1: "magenta",
-        2: "white",
-        3: "cyan",
-        4: "green",
-        5: "yellow",
-        6: "red",
-        7: "magenta",
-    }
-    lv_color = {
-        0: "grey",
-        1: "white",
-        2: "white",
-        3: "cyan",
-        4: "cyan",
-        5: "cyan",
-        6: "green",
-        7: "green",
-        8: "green",
-        9: "yellow",
-        10: "yellow",
-    }
-
-    equip_list = []
-    for i, (info, v) in enumerate(u_info):
-        if i % 5 == 0:
-            equip_table = Table.grid(
+        gun_list = []
+        for info, v, doll in g_info:
+            gun_table = Table.grid(
                 Column("name", width=17, justify="right"),
                 Column("value", width=5, justify="left"),
                 padding=(0, 1, 0, 0),
             )
-        ename, erank = (
-            equip_info[info["eid"]]["name"],
-            6
-            if equip_info[info[f"eid"]]["type"] in [18, 19, 20]
-            else equip_info[info["eid"]]["rank"],
-        )
-        equip_table.add_row(f"[{rank_color[erank]}]{ename}", f"{v.value():2.0f}")
-        if (i + 1) % 5 == 0 or i + 1 == len(u_info):
-            equip_list.append(equip_table)
-
-    strn_table = Table(
-        show_header=False,
-        show_lines=True,
-        box=box.SQUARE,
-        padding=(0, 0, 0, 0),
-        title="强化装备",
-        title_justify="left",
-    )
-    for i in range(0, len(equip_list), box_per_row):
-        strn_table.add_row(*equip_list[i : min(i + box_per_row, len(equip_list))])
-
-    gun_list = []
-    for info, v in g_info:
-        gun_table = Table.grid(
-            Column("name", width=17, justify="right"),
-            Column("value", width=5, justify="left"),
-            padding=(0, 1, 0, 0),
-        )
-        typestr = ["HG", "SMG", "RF", "AR", "MG", "SG"]
-        gun_name, gun_type, gun_rank, gun_favor = (
-            gun_info[info["gid"]]["name"],
-            typestr[gun_info[info["gid"]]["type"] - 1],
-            gun_info[info["gid"]]["rank_display"],
-            user_gun[info["gid"] % 20000]["favor"],
-        )
-        gun_table.add_row(
-            f"[{rank_color[gun_rank]} bold]{gun_name} [/{rank_color[gun_rank]} bold]{gun_type:<3}",
-            f'{"[bold red]o" if gun_favor>100 else "[magenta] "} {gun_favor:3d}',
-        )
-        # res_table.add_row((f'{gun_name}',gun_type))
-        glv, score, slv1, slv2 = (
-            user_gun[info["gid"] % 20000]["gun_level"],
-            info["score"],
-            user_gun[info["gid"] % 20000]["skill1"],
-            user_gun[info["gid"] % 20000]["skill2"],
-        )
-        gun_table.add_row(
-            f"[bold][{rank_color[(glv-1)//20+1]}]Lv{glv:>3}[/{rank_color[(glv-1)//20+1]}] [{lv_color[slv1]}]{slv1:2d}"
-            + "[white]/"
-            + f"[{lv_color[slv2]}]{slv2:2d}",
-            f"{score:>5}",
-        )
-        for e in range(3):
-            ename, elv, erank = (
-                equip_info[info[f"eid_{e+1}"]]["name"],
-                info[f"elv_{e+1}"],
-                6
-                if equip_info[info[f"eid_{e+1}"]]["type"] in [18, 19, 20]
-                else equip_info[info[f"eid_{e+1}"]]["rank"],
+            typestr = ["HG", "SMG", "RF", "AR", "MG", "SG"]
+            gun_name, gun_type, gun_rank, gun_favor = (
+                gun_info[info["gid"]]["name"],
+                typestr[gun_info[info["gid"]]["type"] - 1],
+                gun_info[info["gid"]]["rank_display"],
+                doll["favor"],
             )
             gun_table.add_row(
-                f"[{rank_color[erank]}]{ename}", f"[{lv_color[elv]}]{elv:>2}"
+                f"[{rank_color[gun_rank]} bold]{gun_name} [/{rank_color[gun_rank]} bold]{gun_type:<3}",
+                f'{"[bold red]o" if gun_favor>100 else "[magenta] "} {gun_favor:3d}',
             )
-        gun_list.append(gun_table)
-
-    res_table = Table(
-        show_header=False,
-        show_lines=True,
-        box=box.SQUARE,
-        padding=(0, 0, 0, 0),
-        title="出战配置",
-        title_justify="left",
-    )
+            # res_table.add_row((f'{gun_name}',gun_type))
+            glv, score, slv1, slv2 = (
+                doll["gun_level"],
+                info["score"],
+                doll["skill1"],
+                doll["skill2"],
+            )
+            gun_table.add_row(
+                f"[bold][{rank_color[(glv-1)//20+1]}]Lv{glv:>3}[/{rank_color[(glv-1)//20+1]}] [{lv_color[slv1]}]{slv1:2d}"
+                + "[white]/"
+                + f"[{lv_color[slv2]}]{slv2:2d}",
+                f"{score:>5}",
+            )
+            for e in range(3):
+                ename, elv, erank = (
+                    equip_info[info[f"eid_{e+1}"]]["name"],
+                    info[f"elv_{e+1}"],
+                    6
+                    if equip_info[info[f"eid_{e+1}"]]["type"] in [18, 19, 20]
+                    else equip_info[info[f"eid_{e+1}"]]["rank"],
+                )
+                gun_table.add_row(
+                    f"[{rank_color[erank]}]{ename}", f"[{lv_color[elv]}]{elv:>2}"
+                )
+            gun_list.append(gun_table)
 
-    for i in range(0, max_dolls, box_per_row):
-        res_table.add_row(*gun_list[i : min(i + box_per_row, max_dolls)])
-    full_table = Table(
-        show_header=False,
-        box=None,
-        caption=f"总效能: {resource['score'].value():.0f}",
-        caption_justify="left",
-    )
+        res_table = Table(
+            show_header=False,
+            show_lines=True,
+            box=box.SQUARE,
+            padding=(0, 0, 0, 0),
+            title="出战配置",
+            title_justify="left",
+        )
+
+        for i in range(0, max_dolls, box_per_row):
+            res_table.add_row(*gun_list[i : min(i + box_per_row, max_dolls)])
+        full_table = Table(
+            show_header=False,
+            box=None,
+            caption=(
+                f"总效能: {result['score']:.0f}\n"
+                + (
+                    f"[grey50]使用缓存的计算结果 ({result['backend']})"
+                    if cached
+                    else f"[grey50]建模 {result['timings']['build']:.2f}s，"
+                    f"写入 {result['timings']['write']:.2f}s，"
+                    f"求解 {result['timings']['solve']:.2f}s ({result['backend']})"
+                )
+            ),
+            caption_justify="left",
+        )
+
+        full_table.add_row(strn_table)
+        full_table.add_row(res_table)
+
+        console.print(full_table)
+        timer.lap("output", "run")
 
-    full_table.add_row(strn_table)
-    full_table.add_row(res_table)
 
-    console.print(full_table)
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    timer = StageTimer()
+    args = parser.parse_known_args()[0]
+    os.chdir(Path(__file__).resolve().parent)
+    timer.lap("arguments")
+    try:
+        main(args, timer)
+    finally:
+        if args.timings:
+            timer.report()
@@ -1,8 +1,24 @@
+import heapq
 import itertools
+import logging
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from functools import reduce
 
-from attr_calc import doll_attr_calculate
+import numpy as np
+
+from attr_calc import (
+    EQUIP_VECTOR_KEYS,
+    doll_attr_calculate_batch,
+    get_base_attr_cache,
+)
+from dominance import dominance_keys, prune_dominated
+from equip_table import get_equip_table
+from game_columns import GUN_KEYS
+from recipe_table import RecipeTable, RecipeTableBuilder
+
+logger = logging.getLogger(__name__)
 
 
 def get_theater_config(theater_id, theater_area):
@@ -16,59 +32,195 @@ def get_theater_config(theater_id, theater_area):
     return dict(class_weight=class_weight, advantage=advantage, fight_mode=fight_mode)
 
 
+def get_theater_stages(theater_area, season=None):
+    # fortress stages, optionally only those of one season (theater_id // 100)
+    return sorted(
+        id
+        for id, area_cfg in theater_area.items()
+        if area_cfg["boss"] != "" and (season is None or id // 100 == season)
+    )
+
+
+def stage_scores(choices, gun_info, theater_config, fairy_ratio) -> np.ndarray:
+    """Scores of every recipe in another stage, from the stored effects.
+
+    Same formula as doll_choices; upgrade recipes score 0.
+    """
+    dolls = ~choices.upgrades
+    gid = choices.gid[dolls]
+    types = {g: gun_info[g]["type"] for g in np.unique(gid).tolist()}
+    class_weight = np.array(theater_config["class_weight"])[
+        [types[g] - 1 for g in gid.tolist()]
+    ]
+    sp_ratio = np.where(
+        np.isin(choices.doll[dolls], theater_config["advantage"]), 1.2, 1
+    )
+    effect = choices.effect[dolls, 0 if theater_config["fight_mode"] == "day" else 1]
+    scores = np.zeros(len(choices), dtype=np.int64)
+    scores[dolls] = np.floor(class_weight * sp_ratio * fairy_ratio * effect / 100)
+    return scores
+
+
+def option_supply(option, my_equip, upgrade_slack):
+    # copies of (eid, elv) that can be equipped without competing for upgrades
+    eid, elv = option
+    if elv == 0:
+        return my_equip["level_00"]
+    return my_equip["level_10"] + (my_equip["level_00"] if upgrade_slack else 0)
+
+
+def best_first_loadouts(equip_choices, options, bound, max_dolls):
+    """Yield the valid loadouts of one doll in descending score order.
+
+    bound(vectors) scores rows of summed stat vectors. Score never decreases
+    with any stat, so filling the free slots of a partial loadout with the
+    per-slot maximum of every stat bounds all of its completions, and a heap
+    ordered by these bounds pops complete loadouts best first.
+
+    Stops once the loadouts yielded so far can not all be taken away by the
+    other max_dolls - 1 dolls, since any later loadout could then be swapped
+    for a yielded one that is still available and scores no less. Yielded
+    loadouts with pairwise disjoint equipments are tracked: taking one away
+    needs as many other dolls as the smallest supply among its options, and
+    every doll holds 3 equipments.
+    """
+    if not all(equip_choices):
+        return
+    slot_max = [np.max([options[o][1] for o in c], axis=0) for c in equip_choices]
+    rest = [sum(slot_max[k + 1 :], np.zeros_like(slot_max[0])) for k in range(3)]
+    counter = itertools.count()
+    heap = [(0, next(counter), (), 0)]
+    used_eids = set()
+    costs = []
+    while heap:
+        _, _, loadout, vector = heapq.heappop(heap)
+        if len(loadout) == 3:
+            yield loadout
+            eids = {eid for eid, elv in loadout}
+            if not eids & used_eids:
+                used_eids |= eids
+                costs.append(min(options[o][2] for o in loadout))
+                if max(max(costs), math.ceil(sum(costs) / 3)) >= max_dolls:
+                    return
+            continue
+        k = len(loadout)
+        types = {options[o][0] for o in loadout}
+        children = [o for o in equip_choices[k] if options[o][0] not in types]
+        if not children:
+            continue
+        vectors = vector + np.array([options[o][1] for o in children])
+        for o, b, v in zip(children, bound(vectors + rest[k]).tolist(), vectors):
+            heapq.heappush(heap, (-b, next(counter), loadout + (o,), v))
+
+
+def doll_choices(
+    id, gun, my_gun, equip_choices, options, scoring, max_dolls=None, base_cache=None
+):
+    """Every valid loadout of one doll, in itertools.product order.
+
+    options maps each (eid, elv) of equip_choices to its equipment type, stat
+    vector and supply, so this only needs per-doll data and can run in a
+    worker. Loadouts that only reorder the equipments of an earlier one use
+    the same resources for the same effect and are skipped. With max_dolls,
+    loadouts come from best_first_loadouts instead of the full product.
+
+    Returns the loadouts as arrays for RecipeTableBuilder.add_loadouts, the
+    options they index into, and the number of skipped loadouts.
+    """
+    class_weight, sp_ratio, fairy_ratio, fight_mode = scoring
+
+    def scores(effect):
+        return np.floor(class_weight * sp_ratio * fairy_ratio * effect / 100)
+
+    def bound(vectors):
+        effect = doll_attr_calculate_batch(gun, my_gun, vectors, base_cache=base_cache)
+        return scores(effect[fight_mode])
+
+    if max_dolls is None:
+        loadouts = itertools.product(*equip_choices)
+    else:
+        loadouts = best_first_loadouts(equip_choices, options, bound, max_dolls)
+    # reordering is only possible when slots share options
+    slots = [set(c) for c in equip_choices]
+    shared = slots[0] & slots[1] or slots[0] & slots[2] or slots[1] & slots[2]
+    combos = []
+    seen = set()
+    duplicates = 0
+    for equips in loadouts:
+        if len({options[option][0] for option in equips}) < 3:
+            continue
+        if shared:
+            multiset = tuple(sorted(equips))
+            if multiset in seen:
+                duplicates += 1
+                continue
+            seen.add(multiset)
+        combos.append(equips)
+    option_list = list(options)
+    index = {option: i for i, option in enumerate(option_list)}
+    combos = np.array(
+        [[index[option] for option in equips] for equips in combos], dtype=np.int32
+    ).reshape(-1, 3)
+    if len(combos) == 0:
+        return option_list, combos, np.zeros((0, 2)), np.zeros(0), duplicates
+    vectors = np.array([options[option][1] for option in option_list])
+    effects = doll_attr_calculate_batch(
+        gun, my_gun, vectors[combos].sum(axis=1), base_cache=base_cache
+    )
+    effect = np.column_stack([effects["day"], effects["night"]])
+    return (
+        option_list,
+        combos,
+        effect,
+        scores(effects[fight_mode]).astype(np.int64),
+        duplicates,
+    )
+
+
+def _doll_choices_task(task):
+    return doll_choices(*task)
+
+
 def prepare_choices(
-    user_gun, user_equip, theater_id, max_dolls, fairy_ratio, game_data
-) -> dict[str, dict[str, dict[str, int]]]:
-    gun_info, equip_info = game_data["gun"], game_data["equip"]
+    user_gun,
+    user_equip,
+    theater_id,
+    max_dolls,
+    fairy_ratio,
+    game_data,
+    upgrade_resource=None,
+    prune=True,
+    stats=None,
+    jobs=1,
+    best_first=False,
+    fight_modes=None,
+) -> RecipeTable:
+    gun_info = game_data["gun"]
+    equip_table = get_equip_table(game_data)
+    base_cache = get_base_attr_cache(game_data)
     theater_config = get_theater_config(theater_id, game_data["theater_area"])
-    choices = {}
-
-    for eid, equip in equip_info.items():
-        stat = {}
-        bonus = {
-            s.split(":")[0]: int(s.split(":")[1])
-            for s in equip["bonus_type"].split(",")
-            if equip["bonus_type"]
-        }
-        for k in [
-            "pow",
-            "hit",
-            "dodge",
-            "speed",
-            "rate",
-            "critical_harm_rate",
-            "critical_percent",
-            "armor_piercing",
-            "armor",
-            "shield",
-            "damage_amplify",
-            "damage_reduction",
-            "night_view_percent",
-            "bullet_number_up",
-        ]:
-            if equip[k] != "":
-                smin, smax = [int(i) for i in equip[k].split(",")]
-                stat[k] = dict(min=smin, max=smax)
-                if k in bonus:
-                    stat[k]["upgrade"] = bonus[k]
-        equip["stat"] = stat
+    choices = RecipeTableBuilder()
+    stats = {} if stats is None else stats
+    stats.update(candidates=0, pruned=0, duplicates=0)
 
     equip_type_groups = {}
     for eid, my_equip in user_equip.items():
-        equip = equip_info[eid]
-        equip_type_groups.setdefault(equip["type"], {})
-        equip_type_groups[equip["type"]][eid] = my_equip
-        if not equip["bonus_type"]:
+        equip_type = equip_table.equip_type(eid)
+        upgrade = int(equip_table.upgrade[equip_table.row[eid]])
+        equip_type_groups.setdefault(equip_type, {})
+        equip_type_groups[equip_type][eid] = my_equip
+        if upgrade < 0:
             continue
         if my_equip["level_00"] > 0 and my_equip["level_10"] < max_dolls:
-            recipe_name = f"u_e{eid}"
-            recipe_content = {
-                f"e{eid}_0": -1,
-                f"e{eid}_10": 1,
-                "upgrade": -equip["exclusive_rate"],
-            }
-            recipe_info = {"eid": eid}
-            choices[recipe_name] = {"content": recipe_content, "info": recipe_info}
+            choices.add_upgrade(eid, upgrade)
+    # with enough upgrade resource for every equipped slot, upgradable copies
+    # count as +10 copies when checking shortages
+    max_rate = max([v["upgrade"] for v in user_equip.values()], default=0)
+    upgrade_slack = (
+        upgrade_resource is not None and upgrade_resource >= 3 * max_dolls * max_rate
+    )
+    pruned_slots = {}
+    tasks = []
     # pprint(equip_type_groups)
     for id, my_gun in user_gun.items():
         gun = gun_info[my_gun["gun_id"]]
@@ -85,7 +237,7 @@ def prepare_choices(
             {
                 k: v
                 for k, v in reduce(lambda a, b: a | b, eq, {}).items()
-                if id in v["fit_guns"] or (not v["fit_guns"])
+                if equip_table.fits(k, id)
             }
             for eq in tmp
         ]
@@ -98,45 +250,85 @@ def prepare_choices(
             + [(k, 0) for k, v in t.items() if v["level_00"] > 0]
             for t in equip_types
         ]
-        for equips in itertools.product(*equip_choices):
-            if len({equip_info[eid]["type"] for eid, elv in equips}) < 3:
-                continue
-            effect = doll_attr_calculate(
-                gun, my_gun, [(equip_info[eid], elv) for eid, elv in equips]
+        stats["candidates"] += sum(len(c) for c in equip_choices)
+        if prune:
+            # keep whatever any of the fight modes could use
+            keys = list(
+                dict.fromkeys(
+                    k
+                    for mode in fight_modes or [theater_config["fight_mode"]]
+                    for k in dominance_keys(gun, mode)
+                )
             )
-            sp_ratio = 1.2 if id in theater_config["advantage"] else 1
-            score = math.floor(
-                theater_config["class_weight"][gun["type"] - 1]
-                * sp_ratio
-                * fairy_ratio
-                * effect[theater_config["fight_mode"]]
-                / 100
+            for i, options in enumerate(equip_choices):
+                cache_key = (tuple(options), tuple(keys))
+                if cache_key not in pruned_slots:
+                    columns = [
+                        EQUIP_VECTOR_KEYS.index(k)
+                        for k in keys + ["skill_effect", "skill_effect_per"]
+                    ]
+                    kept = prune_dominated(
+                        options,
+                        [equip_table.vector(*o)[columns].tolist() for o in options],
+                        [equip_table.equip_type(eid) for eid, _ in options],
+                        user_equip,
+                        max_dolls,
+                        upgrade_slack,
+                    )
+                    pruned_slots[cache_key] = [options[k] for k in kept]
+                equip_choices[i] = pruned_slots[cache_key]
+                stats["pruned"] += len(options) - len(equip_choices[i])
+        options = {
+            option: (
+                equip_table.equip_type(option[0]),
+                equip_table.vector(*option),
+                option_supply(option, user_equip[option[0]], upgrade_slack),
             )
-            e1, e2, e3 = equips
-            recipe_name = (
-                f"r_g{id}_e{e1[0]}lv{e1[1]}_e{e2[0]}lv{e2[1]}_e{e3[0]}lv{e3[1]}"
+            for option in itertools.chain(*equip_choices)
+        }
+        sp_ratio = 1.2 if id in theater_config["advantage"] else 1
+        scoring = (
+            theater_config["class_weight"][gun["type"] - 1],
+            sp_ratio,
+            fairy_ratio,
+            theater_config["fight_mode"],
+        )
+        tasks.append(
+            (
+                id,
+                {k: gun[k] for k in GUN_KEYS},
+                my_gun,
+                equip_choices,
+                options,
+                scoring,
+                max_dolls if best_first else None,
             )
-            recipe_content = {
-                f"g_{id}": -1,
-                "count": -1,
-                "score": score,
-                f"e{e1[0]}_{e1[1]}": -1,
-                f"e{e2[0]}_{e2[1]}": -1,
-                f"e{e3[0]}_{e3[1]}": -1,
-            }
-            recipe_info = {
-                "gid": my_gun["gun_id"],
-                "eid_1": e1[0],
-                "elv_1": e1[1],
-                "eid_2": e2[0],
-                "elv_2": e2[1],
-                "eid_3": e3[0],
-                "elv_3": e3[1],
-                "effect": effect,
-                "score": score,
-            }
-            choices[recipe_name] = {"content": recipe_content, "info": recipe_info}
-    return choices
+        )
+
+    if jobs <= 0:
+        jobs = os.cpu_count()
+    if jobs > 1 and len(tasks) > 1:
+        # dolls are independent; map keeps user_gun order so the merged
+        # choices are the same as the serial ones
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(
+                pool.map(
+                    _doll_choices_task,
+                    tasks,
+                    chunksize=max(1, len(tasks) // (jobs * 4)),
+                )
+            )
+    else:
+        results = [doll_choices(*task, base_cache=base_cache) for task in tasks]
+    for task, (option_list, combos, effect, score, duplicates) in zip(tasks, results):
+        id, my_gun = task[0], task[2]
+        choices.add_loadouts(id, my_gun["gun_id"], option_list, combos, effect, score)
+        stats["duplicates"] += duplicates
+    logger.info(
+        f"Pruned {stats['pruned']} of {stats['candidates']} equipment candidates, "
+        f"skipped {stats['duplicates']} reordered loadouts"
+    )
+    return choices.build()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Mapping
+
+import numpy as np
+
+# resources every table has, in this order
+BASE_RESOURCES = ["count", "score", "upgrade"]
+
+
+def recipe_capacity(user_gun, user_equip, max_dolls, upgrade_resource) -> dict:
+    # what the roster has of every resource recipes use
+    resource = {}
+    for id in user_gun:
+        resource[f"g_{id}"] = 1
+    for eid, equip in user_equip.items():
+        resource[f"e{eid}_10"] = equip["level_10"]
+        resource[f"e{eid}_0"] = equip["level_00"]
+    resource["count"] = max_dolls
+    resource["score"] = 0
+    resource["upgrade"] = upgrade_resource
+    return resource
+
+
+def _readonly(array):
+    array.setflags(write=False)
+    return array
+
+
+@dataclass(frozen=True)
+class RecipeTable:
+    """Recipes of one problem, one row per recipe.
+
+    The coefficients are a CSR matrix over integer resource ids: row ``i``
+    consumes ``data[indptr[i]:indptr[i + 1]]`` of the resources
+    ``indices[indptr[i]:indptr[i + 1]]``, whose names are in ``resources``.
+    Upgrade recipes come first and have ``doll == 0``; gun recipes keep the
+    doll's user_gun id in ``doll`` and its gun_id in ``gid``. Recipe names and
+    info dicts are only built on request, for output.
+    """
+
+    resources: tuple[str, ...]
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    doll: np.ndarray
+    gid: np.ndarray
+    eid: np.ndarray  # (n, 3), upgrade recipes only use the first column
+    elv: np.ndarray  # (n, 3)
+    effect: np.ndarray  # (n, 2), day and night, whole numbers as in gf_ceil
+    score: np.ndarray
+
+    def __len__(self):
+        return len(self.doll)
+
+    @cached_property
+    def resource_id(self) -> Mapping[str, int]:
+        return {name: i for i, name in enumerate(self.resources)}
+
+    @property
+    def upgrades(self) -> np.ndarray:
+        return self.doll == 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            getattr(self, k).nbytes
+            for k in ["indptr", "indices", "data", "doll", "gid", "eid", "elv"]
+            + ["effect", "score"]
+        )
+
+    def name(self, i) -> str:
+        eid, elv = self.eid[i].tolist(), self.elv[i].tolist()
+        if self.doll[i] == 0:
+            return f"u_e{eid[0]}"
+        return f"r_g{self.doll[i]}" + "".join(f"_e{e}lv{lv}" for e, lv in zip(eid, elv))
+
+    def content(self, i) -> dict[str, int]:
+        span = slice(self.indptr[i], self.indptr[i + 1])
+        return {
+            self.resources[r]: c
+            for r, c in zip(self.indices[span].tolist(), self.data[span].tolist())
+        }
+
+    def info(self, i) -> dict:
+        eid, elv = self.eid[i].tolist(), self.elv[i].tolist()
+        if self.doll[i] == 0:
+            return {"eid": eid[0]}
+        day, night = self.effect[i].tolist()
+        info = {"gid": int(self.gid[i])}
+        for k in range(3):
+            info[f"eid_{k + 1}"] = eid[k]
+            info[f"elv_{k + 1}"] = elv[k]
+        info["effect"] = {"day": day, "night": night}
+        info["score"] = int(self.score[i])
+        return info
+
+    def to_dict(self) -> dict[str, dict]:
+        # the {name: {"content": ..., "info": ...}} form of earlier versions
+        return {
+            self.name(i): {"content": self.content(i), "info": self.info(i)}
+            for i in range(len(self))
+        }
+
+    def by_resource(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The coefficients as CSC: resource ``r`` is used by the recipes
+        ``recipes[indptr[r]:indptr[r + 1]]`` with coefficients ``data[...]``."""
+        order = np.argsort(self.indices, kind="stable")
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        counts = np.bincount(self.indices, minlength=len(self.resources))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return indptr, rows[order], self.data[order]
+
+
+class RecipeTableBuilder:
+    """Collects recipes and interns resource names for a RecipeTable."""
+
+    def __init__(self):
+        self._resources = {}
+        self._upgrades = []
+        self._loadouts = []
+        for name in BASE_RESOURCES:
+            self.resource(name)
+
+    def resource(self, name) -> int:
+        return self._resources.setdefault(name, len(self._resources))
+
+    def add_upgrade(self, eid, cost):
+        self._upgrades.append((eid, cost))
+
+    def add_loadouts(self, id, gid, options, combos, effect, score):
+        """Add the loadouts of one doll.
+
+        combos is a (n, 3) array of indices into options, a list of
+        (eid, elv); effect is (n, 2) day and night effect, score is (n,).
+        """
+        if len(combos) == 0:
+            return
+        option_ids = np.array(
+            [self.resource(f"e{eid}_{elv}") for eid, elv in options], dtype=np.int32
+        )
+        combos = np.asarray(combos)
+        self._loadouts.append(
+            (
+                id,
+                gid,
+                self.resource(f"g_{id}"),
+                np.array(options, dtype=np.int64).reshape(-1, 2),
+                combos,
+                option_ids[combos],
+                np.rint(effect).astype(np.int64),
+                np.asarray(score, dtype=np.int64),
+            )
+        )
+
+    def build(self) -> RecipeTable:
+        count, score, upgrade = (self._resources[k] for k in BASE_RESOURCES)
+        n = len(self._upgrades)
+        eid = np.zeros((n, 3), dtype=np.int64)
+        eid[:, 0] = [e for e, _ in self._upgrades]
+        cost = np.array([c for _, c in self._upgrades], dtype=np.int64)
+        columns = {
+            "indices": [
+                np.column_stack(
+                    [
+                        [self.resource(f"e{e}_0") for e, _ in self._upgrades],
+                        [self.resource(f"e{e}_10") for e, _ in self._upgrades],
+                        np.full(n, upgrade),
+                    ]
+                ).reshape(-1)
+            ],
+            "data": [
+                np.column_stack([np.full(n, -1), np.full(n, 1), -cost]).reshape(-1)
+            ],
+            "doll": [np.zeros(n)],
+            "gid": [np.zeros(n)],
+            "eid": [eid],
+            "elv": [np.zeros((n, 3))],
+            "effect": [np.zeros((n, 2))],
+            "score": [np.zeros(n)],
+        }
+        row_nnz = [np.full(n, 3)]
+        for id, gid, g, options, combos, equips, effect, scores in self._loadouts:
+            n = len(combos)
+            columns["indices"].append(
+                np.column_stack(
+                    [np.full(n, g), np.full(n, count), np.full(n, score), equips]
+                ).reshape(-1)
+            )
+            columns["data"].append(
+                np.column_stack(
+                    [np.full(n, -1), np.full(n, -1), scores, np.full((n, 3), -1)]
+                ).reshape(-1)
+            )
+            columns["doll"].append(np.full(n, id))
+            columns["gid"].append(np.full(n, gid))
+            columns["eid"].append(options[combos, 0])
+            columns["elv"].append(options[combos, 1])
+            columns["effect"].append(effect)
+            columns["score"].append(scores)
+            row_nnz.append(np.full(n, 6))
+        dtypes = dict(indices=np.int32, elv=np.int8)
+        arrays = {
+            k: _readonly(np.concatenate(v).astype(dtypes.get(k, np.int64)))
+            for k, v in columns.items()
+        }
+        indptr = np.concatenate([[0], np.cumsum(np.concatenate(row_nnz))])
+        return RecipeTable(
+            resources=tuple(sorted(self._resources, key=self._resources.get)),
+            indptr=_readonly(indptr.astype(np.int64)),
+            **arrays,
+        )
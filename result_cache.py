@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# bump when the stored results change shape
+CACHE_VERSION = 2
+
+
+def content_hash(data) -> str:
+    # bytes as they are, anything else as canonical json
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """Solve results on disk, one json file per content-addressed key.
+
+    A key is the hash of everything a solve depends on, game data included, so
+    entries of old data are never hit again and just age out: reading an
+    entry refreshes its mtime and the least recently used entries are removed
+    once the cache is larger than max_bytes.
+    """
+
+    def __init__(self, root="./cache", max_bytes=64 << 20):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def key(self, **parts) -> str:
+        return content_hash({"version": CACHE_VERSION, **parts})
+
+    def data_digest(self, *paths) -> str:
+        """Hash of the files in paths, directories standing for every file under them.
+
+        Digests of single files are remembered by size and mtime, so unchanged
+        data is not read again.
+        """
+        index_path = self.root / "files.json"
+        try:
+            index = json.loads(index_path.read_text("utf-8"))
+        except (OSError, ValueError):
+            index = {}
+        digests, changed = [], False
+        files = (
+            p
+            for path in map(Path, paths)
+            for p in (path.rglob("*") if path.is_dir() else [path])
+        )
+        for path in sorted(p for p in files if p.is_file()):
+            stat = path.stat()
+            name = str(path.resolve())
+            if index.get(name, [None])[:2] != [stat.st_size, stat.st_mtime_ns]:
+                digest = content_hash(path.read_bytes())
+                index[name] = [stat.st_size, stat.st_mtime_ns, digest]
+                changed = True
+            digests.append((path.name, index[name][2]))
+        if changed:
+            self._write(index_path, index)
+        return content_hash(digests)
+
+    def get(self, key):
+        path = self.root / f"{key}.json"
+        try:
+            value = json.loads(path.read_text("utf-8"))
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        logger.info(f"Using cached result {key[:12]}")
+        return value
+
+    def put(self, key, value):
+        self._write(self.root / f"{key}.json", value)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.root.glob("*.json"):
+            if path.name == "files.json":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _write(self, path, value):
+        # write then rename, readers never see half an entry
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
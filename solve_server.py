@@ -0,0 +1,358 @@
+"""Local HTTP/JSON solve service, keeping game data and recipes warm.
+
+python solve_server.py -r ch --port 8848
+
+POST /solve with a json body
+    {"region": "ch", "theater_id": 848, "max_dolls": 30, "fairy_ratio": 2,
+     "upgrade_resource": 0, "perfect": false, "user_info": {...}}
+is answered with {"g_records": [...], "u_records": [...], "score": ...}, the
+records of Commander.solve. GET /status reports the regions and the queue.
+Only local data is read, a region has to be downloaded with the GUI first.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from gf_utils2.gamedata import GameData
+from gf_utils2.userinfo.base import BaseGameObject
+
+from commander_new.commander import Commander
+from download_data import REGIONS
+from json_reader import parse_json
+from result_cache import ResultCache, content_hash
+
+logger = logging.getLogger(__name__)
+
+# largest request body accepted, user_info of big accounts included
+MAX_BODY = 64 << 20
+
+
+class Busy(Exception):
+    """Every worker is busy and the queue is full."""
+
+
+class RegionGate:
+    """Lets solves of one region run together while the others wait.
+
+    gf_utils2 looks game data up through BaseGameObject.set_gamedata, which is
+    process-wide, so two regions must not be solved at the same time.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._region = None
+        self._running = 0
+
+    @contextmanager
+    def enter(self, region, game_data):
+        with self._cond:
+            self._cond.wait_for(lambda: self._running == 0 or self._region == region)
+            if self._region != region:
+                BaseGameObject.set_gamedata(game_data)
+                self._region = region
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                if self._running == 0:
+                    self._cond.notify_all()
+
+
+class SolveService:
+    """Solves on a bounded pool, one GameData per region and warm Commanders.
+
+    At most workers solves run at once and queue_size more wait; further
+    requests are refused with Busy instead of piling up. A Commander is kept
+    per region and user_info, max_commanders at most, so a request that only
+    changes parameters re-solves warm; identical requests hit the cache.
+    """
+
+    def __init__(
+        self,
+        data_dir="./data",
+        solver="cbc",
+        workers=2,
+        queue_size=8,
+        jobs=1,
+        cache=None,
+        max_commanders=16,
+    ):
+        self.data_dir = Path(data_dir)
+        self.solver = solver
+        self.workers = workers
+        self.queue_size = queue_size
+        self.jobs = jobs
+        self.cache = cache
+        self.max_commanders = max_commanders
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="Solve")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._gate = RegionGate()
+        self._lock = threading.Lock()
+        # {region: (GameData, data digest)}
+        self._regions = {}
+        # {region: lock held while its GameData loads}
+        self._loading = {}
+        # {(region, user_info digest): (Commander, its lock)}, least recent first
+        self._commanders = OrderedDict()
+        self._pending = 0
+        self._running = 0
+
+    def close(self):
+        self._pool.shutdown()
+
+    def region(self, region):
+        """GameData and data digest of a region, loaded on first use.
+
+        Loading holds only that region's lock, so /status and the other
+        regions are served meanwhile.
+        """
+        with self._lock:
+            if region in self._regions:
+                return self._regions[region]
+        data_dir = self.data_dir / region
+        if region not in REGIONS or not (data_dir / "stc").is_dir():
+            raise LookupError(f"no local data for region {region!r}")
+        with self._lock:
+            loading = self._loading.setdefault(region, threading.Lock())
+        with loading:
+            with self._lock:
+                if region in self._regions:
+                    return self._regions[region]
+            logger.info(f"Loading {region} game data")
+            game_data = GameData(data_dir / "stc", data_dir / "table")
+            digest = self.cache.data_digest(data_dir) if self.cache else ""
+            with self._lock:
+                return self._regions.setdefault(region, (game_data, digest))
+
+    def check_stage(self, region, theater_id):
+        # ValueError unless theater_id is a fortress stage of region
+        game_data, _ = self.region(region)
+        theater_area = game_data["theater_area"]
+        if theater_id not in theater_area:
+            raise ValueError(f"unknown theater_id {theater_id}")
+        try:
+            Commander.get_theater_config(theater_id, theater_area)
+        except AttributeError as e:
+            raise ValueError(str(e)) from None
+
+    def commander(self, region, user_info):
+        key = (region, None if user_info is None else content_hash(user_info))
+        with self._lock:
+            if key in self._commanders:
+                self._commanders.move_to_end(key)
+                return self._commanders[key]
+        game_data, digest = self.region(region)
+        entry = (
+            Commander(
+                game_data,
+                self.solver,
+                user_info or {},
+                jobs=self.jobs,
+                cache=self.cache,
+                data_digest=digest,
+                data_dir=self.data_dir / region,
+            ),
+            threading.Lock(),
+        )
+        with self._lock:
+            entry = self._commanders.setdefault(key, entry)
+            while len(self._commanders) > self.max_commanders:
+                self._commanders.popitem(last=False)
+        return entry
+
+    def submit(self, region, user_info, params):
+        """A future of (g_records, u_records), or Busy if the queue is full."""
+        if not self._slots.acquire(blocking=False):
+            raise Busy()
+        with self._lock:
+            self._pending += 1
+
+        def done(_):
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+        future = self._pool.submit(self._solve, region, user_info, params)
+        future.add_done_callback(done)
+        return future
+
+    def _solve(self, region, user_info, params):
+        game_data, _ = self.region(region)
+        with self._gate.enter(region, game_data):
+            with self._lock:
+                self._running += 1
+            try:
+                commander, lock = self.commander(region, user_info)
+                # a Commander keeps its last solve, one request at a time
+                with lock:
+                    return commander.solve(**params)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def status(self):
+        with self._lock:
+            return {
+                "regions": list(self._regions),
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "commanders": len(self._commanders),
+            }
+
+
+def solve_params(request):
+    # (region, user_info, Commander.solve arguments) of a /solve body
+    if not isinstance(request, dict):
+        raise ValueError("the request must be a json object")
+    perfect = bool(request.get("perfect", False))
+    user_info = None if perfect else request["user_info"]
+    if user_info is not None and not isinstance(user_info, dict):
+        raise ValueError("user_info must be a json object")
+    params = dict(
+        theater_id=int(request["theater_id"]),
+        fairy_ratio=float(request.get("fairy_ratio", 2)),
+        max_dolls=int(request.get("max_dolls", 30)),
+        upgrade_resource=int(request.get("upgrade_resource", 0)),
+        use_perfect=perfect,
+    )
+    return str(request.get("region", "ch")), user_info, params
+
+
+class SolveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "SolveServer"
+
+    def send_json(self, status, value, headers=None):
+        body = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self.send_error_json(404, f"unknown path {self.path}")
+        self.send_json(200, self.server.service.status())
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path != "/solve":
+            return self.send_error_json(404, f"unknown path {self.path}")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # the body cannot be told apart from the next request
+            self.close_connection = True
+            return self.send_error_json(400, "bad Content-Length")
+        if length > MAX_BODY:
+            self.close_connection = True
+            return self.send_error_json(413, f"request larger than {MAX_BODY} bytes")
+        try:
+            region, user_info, params = solve_params(
+                parse_json(self.rfile.read(length))
+            )
+            service.check_stage(region, params["theater_id"])
+        except (ValueError, KeyError, TypeError, LookupError) as e:
+            return self.send_error_json(400, f"bad request: {e!r}")
+        try:
+            future = service.submit(region, user_info, params)
+        except Busy:
+            return self.send_error_json(
+                503, "too many requests, retry later", {"Retry-After": "5"}
+            )
+        try:
+            g_records, u_records = future.result()
+        except Exception as e:
+            logger.exception(f"Solve failed: {e!r}")
+            return self.send_error_json(500, f"solve failed: {e!r}")
+        self.send_json(
+            200,
+            {
+                "g_records": g_records,
+                "u_records": u_records,
+                "score": sum(r["score"] for r in g_records),
+            },
+        )
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+class SolveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service: SolveService):
+        super().__init__(address, SolveHandler)
+        self.service = service
+
+
+if __name__ == "__main__":
+    os.chdir(Path(__file__).resolve().parent)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8848)
+    parser.add_argument(
+        "-r",
+        "--regions",
+        nargs="+",
+        choices=REGIONS,
+        default=["ch"],
+        help="预先加载的服务器数据，需已下载到data目录",
+    )
+    parser.add_argument("-w", "--workers", type=int, default=2, help="同时求解的请求数")
+    parser.add_argument(
+        "-q",
+        "--queue_size",
+        type=int,
+        default=8,
+        help="排队等待的请求数，超出时返回503",
+    )
+    parser.add_argument(
+        "-s", "--solver", choices=["cbc", "highs", "pulp"], default="cbc"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="每个请求生成配装方案的进程数"
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="不使用也不保存缓存的计算结果"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    service = SolveService(
+        solver=args.solver,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        jobs=args.jobs,
+        cache=None if args.no_cache else ResultCache("./cache"),
+    )
+    for region in args.regions:
+        service.region(region)
+    with SolveServer((args.host, args.port), service) as server:
+        logger.info(f"Serving on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
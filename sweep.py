@@ -0,0 +1,313 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from attr_calc import get_base_attr_cache
+from equip_table import get_equip_table
+from game_columns import DISPLAY_COLUMNS, GAME_DATA_COLUMNS
+from gf_utils import GameData
+from json_reader import parse_json
+from load_user_info import load_user_info
+from lp_model import LpModel
+from prepare_choices import prepare_choices, stage_scores
+from recipe_table import recipe_capacity
+
+# game data of a batch worker process, see _init_batch_worker
+_worker_game_data = None
+
+
+def sweep_range(spec) -> list[int]:
+    """Parse ``start:stop[:step]`` (stop included) or a single value."""
+    parts = [int(p) for p in str(spec).split(":")]
+    if len(parts) == 1:
+        return parts
+    start, stop, step = (parts + [1])[:3]
+    if step <= 0 or stop < start:
+        raise ValueError(f"bad range {spec!r}, expected start:stop[:step]")
+    return list(range(start, stop + 1, step))
+
+
+def sweep(choices, user_gun, user_equip, dolls, upgrades, backend, weight=None):
+    """Solve every (max_dolls, upgrade_resource) pair of the grid.
+
+    choices must be prepared for max(dolls) and min(upgrades), which keeps
+    every recipe the other points could use. The points share one model and
+    each is started from an earlier solution that is still feasible for it:
+    the previous point of the same max_dolls, or the same upgrade_resource
+    with fewer dolls.
+    """
+    dolls, upgrades = sorted(set(dolls)), sorted(set(upgrades))
+    if weight is None:
+        weight = {"score": 1, "upgrade": 0.001}
+    model = LpModel.from_recipes(
+        choices,
+        recipe_capacity(user_gun, user_equip, dolls[-1], upgrades[-1]),
+        weight,
+    )
+    score, count, upgrade = (model.row_id(k) for k in ["score", "count", "upgrade"])
+    table, row_starts = [], {}
+    for max_dolls in dolls:
+        start = None
+        for upgrade_resource in upgrades:
+            if start is None:
+                start = row_starts.get(upgrade_resource)
+            # derived from the last point, which carries its cached MPS columns
+            model = model.with_capacity(
+                recipe_capacity(user_gun, user_equip, max_dolls, upgrade_resource)
+            )
+            solution = backend.solve(model, start=start)
+            left = model.activity(solution.x)
+            table.append(
+                {
+                    "max_dolls": max_dolls,
+                    "upgrade_resource": upgrade_resource,
+                    "score": round(left[score]),
+                    "dolls": round(max_dolls - left[count]),
+                    "upgrades": round(upgrade_resource - left[upgrade]),
+                    "status": solution.status,
+                    **solution.timings,
+                }
+            )
+            start = solution.x if solution.status == "Optimal" else None
+            row_starts[upgrade_resource] = start
+    return table
+
+
+def solve_stages(
+    choices, capacity, stages, gun_info, fairy_ratio, backend, jobs=1, weight=None
+):
+    """Solve the same roster for several stages of a theater.
+
+    stages maps theater ids to get_theater_config results. choices must be
+    prepared with every fight mode of the stages and without best_first; only
+    the score row differs between stages, so the effects are computed once.
+    With jobs > 1 the stages are solved in threads, the solvers release the
+    GIL; otherwise each stage starts from the previous team, which is still
+    feasible since the constraints are the same.
+    """
+    if weight is None:
+        weight = {"score": 1, "upgrade": 0.001}
+    model = LpModel.from_recipes(choices, capacity, weight)
+    score, count, upgrade = (model.row_id(k) for k in ["score", "count", "upgrade"])
+    dolls = ~choices.upgrades
+
+    def solve(theater_id, start=None):
+        config = stages[theater_id]
+        stage = model.with_row(
+            "score", stage_scores(choices, gun_info, config, fairy_ratio)
+        )
+        solution = backend.solve(stage, start=start)
+        left = stage.activity(solution.x)
+        used = np.flatnonzero((solution.x > 0.5) & dolls)
+        used = used[np.argsort(-stage.row_values("score")[used], kind="stable")]
+        row = {
+            "theater_id": theater_id,
+            "fight_mode": config["fight_mode"],
+            "score": round(left[score]),
+            "dolls": round(capacity["count"] - left[count]),
+            "upgrades": round(capacity["upgrade"] - left[upgrade]),
+            "status": solution.status,
+            "team": choices.gid[used].tolist(),
+            **solution.timings,
+        }
+        return row, solution
+
+    if jobs > 1 and len(stages) > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            return [row for row, _ in pool.map(solve, stages)]
+    table, start = [], None
+    for theater_id in stages:
+        row, solution = solve(theater_id, start)
+        table.append(row)
+        start = solution.x if solution.status == "Optimal" else None
+    return table
+
+
+def team_result(choices, model, solution, user_gun, game_data):
+    # what the output needs of a solve, json-serializable for the result cache
+    u_info, g_info = [], []
+    upgrades = choices.upgrades
+    for i, v in enumerate(solution.x.tolist()):
+        if v > 0:
+            if upgrades[i]:
+                u_info.append([choices.info(i), v])
+            else:
+                info = choices.info(i)
+                my_gun = user_gun[info["gid"] % 20000]
+                doll = {
+                    k: int(my_gun[k])
+                    for k in ["favor", "gun_level", "skill1", "skill2"]
+                }
+                g_info.append([info, v, doll])
+    gids = {info["gid"] for info, _, _ in g_info}
+    eids = {info["eid"] for info, _ in u_info}
+    eids.update(info[f"eid_{e}"] for info, _, _ in g_info for e in (1, 2, 3))
+    return {
+        "u_info": u_info,
+        "g_info": g_info,
+        # {table: {id as str: {field: value}}} of the rows shown
+        **{
+            f"{table}_info": {
+                str(i): {k: game_data[table][i][k] for k in DISPLAY_COLUMNS[table]}
+                for i in sorted(ids)
+            }
+            for table, ids in [("gun", gids), ("equip", eids)]
+        },
+        "score": float(model.activity(solution.x)[model.row_id("score")]),
+        "timings": dict(solution.timings),
+    }
+
+
+def account_files(paths) -> list[Path]:
+    # user_info files, directories standing for the .json files in them
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.json")) if path.is_dir() else [path])
+    return files
+
+
+def solve_account(
+    path,
+    theater_id,
+    max_dolls,
+    fairy_ratio,
+    upgrade_resource,
+    backend,
+    encodings=(),
+    game_data=None,
+):
+    """Best team of one user_info file: a summary row and its team_result."""
+    start = time.perf_counter()
+    user_info = parse_json(Path(path).read_bytes(), encodings)
+    user_gun, user_equip = load_user_info(user_info, game_data)
+    choices = prepare_choices(
+        user_gun,
+        user_equip,
+        theater_id,
+        max_dolls,
+        fairy_ratio,
+        game_data,
+        upgrade_resource=upgrade_resource,
+    )
+    prepare_time = time.perf_counter() - start
+    capacity = recipe_capacity(user_gun, user_equip, max_dolls, upgrade_resource)
+    start = time.perf_counter()
+    model = LpModel.from_recipes(choices, capacity, {"score": 1, "upgrade": 0.001})
+    build_time = time.perf_counter() - start
+    solution = backend.solve(model)
+    result = team_result(choices, model, solution, user_gun, game_data)
+    result["timings"].update(prepare=prepare_time, build=build_time)
+    result["backend"] = backend.name
+    left = model.activity(solution.x)
+    row = {
+        "score": round(left[model.row_id("score")]),
+        "dolls": round(capacity["count"] - left[model.row_id("count")]),
+        "upgrades": round(capacity["upgrade"] - left[model.row_id("upgrade")]),
+        "recipes": len(choices),
+        "status": solution.status,
+        **result["timings"],
+    }
+    return row, result
+
+
+def _init_batch_worker(data_dir):
+    global _worker_game_data
+    _worker_game_data = GameData(data_dir, columns=GAME_DATA_COLUMNS)
+    # what does not depend on the account, compiled once per process
+    get_equip_table(_worker_game_data)
+    get_base_attr_cache(_worker_game_data)
+
+
+def _solve_account_task(args):
+    return solve_account(*args, game_data=_worker_game_data)
+
+
+def solve_batch(
+    files,
+    data_dir,
+    out_dir,
+    theater_id,
+    max_dolls,
+    fairy_ratio,
+    upgrade_resource,
+    backend,
+    encodings=(),
+    jobs=1,
+    progress=None,
+):
+    """Solve the same stage for every user_info file.
+
+    The team of each account is written to out_dir/<name>.json, named after
+    its file; the summary rows are returned in the order of files, accounts
+    that failed with their error instead of a score. With jobs > 1 accounts
+    are spread over processes, each loading the game data and compiling the
+    equipment table once for all the accounts it solves. progress(done,
+    total, name) is called after each account.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for path in map(Path, files):
+        name, n = path.stem, 1
+        while name in names:
+            name, n = f"{path.stem}_{n}", n + 1
+        names.append(name)
+    tasks = [
+        (path, theater_id, max_dolls, fairy_ratio, upgrade_resource, backend, encodings)
+        for path in files
+    ]
+    table = [None] * len(tasks)
+
+    def record(i, outcome):
+        try:
+            row, result = outcome()
+        except Exception as e:
+            table[i] = {"account": names[i], "error": repr(e)}
+        else:
+            result = {"account": names[i], "file": str(files[i]), **result}
+            (out_dir / f"{names[i]}.json").write_text(
+                json.dumps(result, ensure_ascii=False, indent=1), "utf-8"
+            )
+            table[i] = {"account": names[i], **row}
+        if progress is not None:
+            progress(sum(row is not None for row in table), len(tasks), names[i])
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(
+            min(jobs, len(tasks)),
+            initializer=_init_batch_worker,
+            initargs=(str(data_dir),),
+        ) as pool:
+            futures = {
+                pool.submit(_solve_account_task, t): i for i, t in enumerate(tasks)
+            }
+            for future in as_completed(futures):
+                record(futures[future], future.result)
+    else:
+        game_data = GameData(data_dir, columns=GAME_DATA_COLUMNS)
+        for i, task in enumerate(tasks):
+            record(i, lambda: solve_account(*task, game_data=game_data))
+    return table
+
+
+def write_table(table, path):
+    # rows of dicts as .json, anything else as csv
+    path = Path(path)
+    if path.suffix.lower() == ".json":
+        path.write_text(json.dumps(table, ensure_ascii=False, indent=2), "utf-8")
+        return
+    fields = list(dict.fromkeys(k for row in table for k in row))
+    with path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(
+            {
+                k: ";".join(map(str, v)) if isinstance(v, list) else v
+                for k, v in row.items()
+            }
+            for row in table
+        )
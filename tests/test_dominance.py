@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import pytest
+
+from dominance import prune_dominated
+
+DATA = Path(__file__).resolve().parents[1] / "data" / "ch"
+
+
+def test_prune_dominated():
+    options = [(1, 0), (1, 10), (2, 0), (3, 0)]
+    vectors = [[5, 5], [6, 5], [6, 5], [9, 0]]
+    types = [1, 1, 1, 1]
+    user_equip = {
+        1: {"level_00": 2, "level_10": 1},
+        2: {"level_00": 3, "level_10": 0},
+        3: {"level_00": 1, "level_10": 0},
+    }
+    # (1, 10) ties with (2, 0), which needs no upgrade; (1, 0) is beaten by
+    # both, and (3, 0) by nothing
+    assert prune_dominated(options, vectors, types, user_equip, 3, False) == [2, 3]
+    # too few copies of the better options to replace it in every doll
+    kept = prune_dominated(options, vectors, types, user_equip, 5, False)
+    assert kept == [0, 1, 2, 3]
+    # with upgrade slack the level 0 copies of 1 count as level 10 ones too
+    assert prune_dominated(options, vectors, types, user_equip, 5, True) == [1, 2, 3]
+
+
+@pytest.mark.skipif(not DATA.is_dir(), reason="needs the game data in data/ch")
+def test_pruning_keeps_the_best_loadouts():
+    from gf_utils import GameData
+    from load_user_info import load_perfect_info
+    from prepare_choices import prepare_choices
+
+    game_data = GameData(DATA)
+    user_gun, user_equip = load_perfect_info(game_data)
+    theater_area = game_data["theater_area"]
+    stages = [idx for idx in theater_area if theater_area[idx]["boss"]]
+    modes = {theater_area[idx]["boss"][-1] == "0": idx for idx in stages}
+    for theater_id in modes.values():
+        for max_dolls in [5, 10]:
+            best, pruned = [], 0
+            for prune in [True, False]:
+                stats = {}
+                table = prepare_choices(
+                    user_gun,
+                    user_equip,
+                    theater_id,
+                    max_dolls,
+                    2,
+                    game_data,
+                    upgrade_resource=0,
+                    prune=prune,
+                    stats=stats,
+                )
+                guns = ~table.upgrades
+                scores = {}
+                for doll, score in zip(table.doll[guns], table.score[guns]):
+                    scores[doll] = max(scores.get(doll, score), score)
+                best.append(scores)
+                pruned += stats["pruned"]
+            # no pruned option makes a better loadout than the kept ones
+            assert pruned and best[0] == best[1]
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloader
+from downloader import Downloader, DownloadError, rollback, swap
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves server.files by path with ETags, and logs every response."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            return self.reply(404)
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.reply(304, etag=etag)
+        self.reply(200, body, etag)
+
+    def reply(self, status, body=b"", etag=None):
+        self.server.log.append((self.path, status))
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.daemon_threads = True
+    server.files = {f"/t{i}.json": f"[{i}]".encode() for i in range(12)}
+    server.log = []
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class Killed(BaseException):
+    """Stands for the process dying in the middle of a swap."""
+
+
+def stage(files):
+    staged = []
+    for path, body in files.items():
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(body)
+        staged.append((path, tmp))
+    return staged
+
+
+def replace_until(monkeypatch, calls):
+    # os.replace in downloader works for calls times, then the process dies
+    real, count = os.replace, [0]
+
+    def replace(src, dst):
+        count[0] += 1
+        if count[0] > calls:
+            raise Killed()
+        real(src, dst)
+
+    monkeypatch.setattr(downloader.os, "replace", replace)
+    # a killed process does not roll back on its way out
+    monkeypatch.setattr(downloader, "rollback", lambda meta_path: False)
+
+
+def test_swap_killed_rolls_back_only_started_files(tmp_path, monkeypatch):
+    meta = tmp_path / "ch.download.json"
+    a, b = tmp_path / "a.json", tmp_path / "b.json"
+    a.write_text("a1")
+    b.write_text("b1")
+    meta.write_text("meta1")
+    # left over by an earlier swap that finished but was killed before cleanup
+    b.with_name("b.json.old").write_text("b0")
+    meta.with_name(meta.name + ".old").write_text("meta0")
+
+    # journal, a.json moved away, a.json moved in, journal, then killed
+    replace_until(monkeypatch, 3)
+    with pytest.raises(Killed):
+        swap(stage({a: "a2", b: "b2", meta: "meta2"}), meta)
+    monkeypatch.undo()
+
+    assert rollback(meta)
+    assert [p.read_text() for p in (a, b, meta)] == ["a1", "b1", "meta1"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "a.json",
+        "b.json",
+        "ch.download.json",
+    ]
+    assert not rollback(meta)
+
+
+def test_swap_failure_rolls_back(tmp_path, monkeypatch):
+    meta = tmp_path / "ch.download.json"
+    a, b = tmp_path / "a.json", tmp_path / "b.json"
+    a.write_text("a1")
+    meta.write_text("meta1")
+    real = os.replace
+
+    def replace(src, dst):
+        if str(dst) == str(b):
+            raise OSError("disk full")
+        real(src, dst)
+
+    monkeypatch.setattr(downloader.os, "replace", replace)
+    with pytest.raises(OSError):
+        swap(stage({a: "a2", b: "b2", meta: "meta2"}), meta)
+    monkeypatch.undo()
+    assert [a.read_text(), meta.read_text(), b.exists()] == ["a1", "meta1", False]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json", "ch.download.json"]
+
+
+def test_swap(tmp_path):
+    meta = tmp_path / "ch.download.json"
+    a = tmp_path / "a.json"
+    a.write_text("a1")
+    meta.write_text("meta1")
+    swap(stage({a: "a2", meta: "meta2"}), meta)
+    assert [a.read_text(), meta.read_text()] == ["a2", "meta2"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json", "ch.download.json"]
+
+
+def test_download(server, tmp_path):
+    files = [(server.url + name, tmp_path / name[1:]) for name in server.files]
+    progress = []
+    with Downloader(max_workers=4) as dl:
+        assert dl.download(files, lambda *args: progress.append(args)) == [
+            path for _, path in files
+        ]
+    for name, body in server.files.items():
+        assert (tmp_path / name[1:]).read_bytes() == body
+    assert [done for done, _, _ in progress] == list(range(1, 13))
+    assert {total for _, total, _ in progress} == {12}
+    assert sorted(url for _, _, url in progress) == sorted(url for url, _ in files)
+
+
+def test_download_not_found(server, tmp_path):
+    files = [
+        (server.url + "/t0.json", tmp_path / "t0.json"),
+        (server.url + "/missing.json", tmp_path / "missing.json"),
+    ]
+    with Downloader(max_workers=2) as dl:
+        with pytest.raises(DownloadError) as e:
+            dl.download(files)
+    assert e.value.status == 404
+    assert e.value.url == server.url + "/missing.json"
+    # a client error is not retried, the other file is still stored
+    assert server.log.count(("/missing.json", 404)) == 1
+    assert (tmp_path / "t0.json").exists()
+    assert not (tmp_path / "missing.json").exists()
+
+
+def test_refresh(server, tmp_path):
+    meta = tmp_path / "meta.json"
+    files = [(server.url + name, tmp_path / name[1:]) for name in server.files]
+    with Downloader(max_workers=4) as dl:
+        dl.download(files, meta_path=meta)
+        server.log.clear()
+        assert dl.refresh(files, meta) == []
+        assert {status for _, status in server.log} == {304}
+
+        server.files["/t3.json"] = b"[33]"
+        server.log.clear()
+        assert dl.refresh(files, meta) == [tmp_path / "t3.json"]
+    assert [path for path, status in server.log if status != 304] == ["/t3.json"]
+    assert (tmp_path / "t3.json").read_bytes() == b"[33]"
+    assert not [p for p in tmp_path.iterdir() if p.suffix in (".tmp", ".old")]
+
+
+def test_close(server, tmp_path):
+    dl = Downloader(max_workers=4)
+    dl.download([(server.url + name, tmp_path / name[1:]) for name in server.files])
+    dl.fetch(server.url + "/t0.json")
+    connections = set(dl._connections)
+    assert connections and all(conn.sock is not None for conn in connections)
+    dl.close()
+    assert all(conn.sock is None for conn in connections)
+    assert not dl._connections
+    # still usable, with new connections
+    assert dl.fetch(server.url + "/t0.json") == b"[0]"
+    dl.close()
@@ -0,0 +1,113 @@
+import pytest
+
+from load_user_info import GUN_FIELDS, load_user_info
+
+GAME_DATA = {
+    "gun": {
+        2: {"name": "Colt Revolver"},
+        20002: {"name": "Colt Revolver Mod"},
+        55: {"name": "M4A1"},
+    },
+    "equip": {
+        40: {
+            "name": "PEQ-16",
+            "rank": 5,
+            "bonus_type": "",
+            "exclusive_rate": 0,
+            "fit_guns": "",
+        },
+        191: {
+            "name": "M4 SOPMOD block II",
+            "rank": 5,
+            "bonus_type": "dodge",
+            "exclusive_rate": "10",
+            "fit_guns": "55,20055",
+        },
+        7: {
+            "name": "ITI Mars",
+            "rank": 3,
+            "bonus_type": "",
+            "exclusive_rate": 0,
+            "fit_guns": "",
+        },
+    },
+}
+
+
+def gun(gun_id, gun_level, skill1, skill2, number, favor):
+    # a record as GFAlarm exports it, every value a string
+    return dict(
+        id="1",
+        gun_id=str(gun_id),
+        gun_level=str(gun_level),
+        skill1=str(skill1),
+        skill2=str(skill2),
+        number=str(number),
+        favor=str(favor),
+    )
+
+
+USER_INFO = {
+    "gun_with_user_info": [
+        gun(55, 100, 10, 0, 5, 1500000),
+        # two copies of one doll, every field is the best of either
+        gun(2, 110, 8, 0, 5, 1000000),
+        gun(20002, 100, 10, 6, 3, 1400000),
+    ],
+    "equip_with_user_info": {
+        "1": {"equip_id": "191", "equip_level": "10"},
+        "2": {"equip_id": "191", "equip_level": "3"},
+        "3": {"equip_id": "40", "equip_level": "0"},
+        "4": {"equip_id": "7", "equip_level": "10"},
+    },
+}
+
+
+def test_load_user_info():
+    gun_user, equip_user = load_user_info(USER_INFO, GAME_DATA)
+    assert list(gun_user) == [2, 55]
+    assert gun_user[2] == dict(
+        gun_id=20002,
+        gun_level=110,
+        skill1=10,
+        skill2=6,
+        number=5,
+        favor=140,
+        name="Colt Revolver Mod",
+    )
+    assert list(gun_user[55]) == GUN_FIELDS + ["name"]
+    assert all(type(v) is int for k, v in gun_user[55].items() if k != "name")
+
+    assert list(equip_user) == [40, 191]
+    assert equip_user[191] == dict(
+        equip_id=191,
+        level_10=1,
+        level_00=1,
+        name="M4 SOPMOD block II",
+        rank=5,
+        upgrade=10,
+        fit_guns=[55, 20055],
+    )
+    assert equip_user[40]["upgrade"] == -1 and equip_user[40]["fit_guns"] == []
+
+
+def test_missing_fields_count_as_zero():
+    record = gun(55, 90, 7, 0, 4, 0)
+    del record["favor"]
+    gun_user, _ = load_user_info(
+        {"gun_with_user_info": [record], "equip_with_user_info": {}}, GAME_DATA
+    )
+    assert gun_user[55]["favor"] == 0
+
+
+def test_matches_pandas():
+    pytest.importorskip("pandas")
+    from benchmark import load_user_info_pandas
+
+    expected = load_user_info_pandas(USER_INFO, GAME_DATA)
+    for records, expected_records in zip(
+        load_user_info(USER_INFO, GAME_DATA), expected
+    ):
+        assert records == expected_records
+        for idx, record in records.items():
+            assert list(record) == list(expected_records[idx])
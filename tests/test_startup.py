@@ -0,0 +1,84 @@
+"""main_cli starts without the modules it only needs to download or solve.
+
+Each run is a new process on a copy of the CLI whose tables are empty, so
+nothing is downloaded; the cached run gets a stored result from the cache.
+Which modules were imported is checked, not how long that took.
+"""
+
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from download_data import TABLES
+
+ROOT = Path(__file__).resolve().parents[1]
+# imported by the download and solve stages only
+HEAVY = {"numpy", "pulp", "http.client", "prepare_choices"}
+CACHED_RESULT = {
+    "u_info": [],
+    "g_info": [],
+    "gun_info": {},
+    "equip_info": {},
+    "score": 0,
+    "timings": {},
+    "backend": "cbc",
+}
+# runs main_cli as a script and writes the names in sys.modules to argv[1]
+RUNNER = """
+import json, runpy, sys
+
+out, result, args = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3:]
+if result is not None:
+    import result_cache
+
+    result_cache.ResultCache.get = lambda self, key: result
+sys.argv = ["main_cli.py", *args]
+try:
+    runpy.run_path("main_cli.py", run_name="__main__")
+except SystemExit:
+    pass
+with open(out, "w") as f:
+    json.dump(sorted(sys.modules), f)
+"""
+
+
+@pytest.fixture(scope="module")
+def workspace(tmp_path_factory):
+    root = tmp_path_factory.mktemp("cli")
+    for path in ROOT.glob("*.py"):
+        shutil.copy(path, root)
+    (root / "data" / "ch").mkdir(parents=True)
+    for table in TABLES:
+        (root / "data" / "ch" / f"{table}.json").write_text("[]")
+    return root
+
+
+def run_cli(workspace, tmp_path, *args, result=None):
+    out = tmp_path / "modules.json"
+    process = subprocess.run(
+        [sys.executable, "-c", RUNNER, str(out), json.dumps(result), *args],
+        cwd=workspace,
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+    return process.stdout, set(json.loads(out.read_text()))
+
+
+def test_help(workspace, tmp_path):
+    stdout, modules = run_cli(workspace, tmp_path, "--help")
+    assert "usage:" in stdout
+    assert not (HEAVY | {"rich"}) & modules
+
+
+def test_cached_run(workspace, tmp_path):
+    stdout, modules = run_cli(
+        workspace, tmp_path, "848", "-p", "-m", "10", result=CACHED_RESULT
+    )
+    # the caption is wrapped to the width of the empty team
+    assert "使用缓存的计算结果" in "".join(stdout.split())
+    assert not HEAVY & modules